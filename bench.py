@@ -0,0 +1,560 @@
+"""
+离线基准测试：用 bench_fixtures/ 里的商品页衡量各解析函数的耗时与内存分配，并校验判定没有变化。
+
+manifest 里 "synthetic": true 的 fixture 是照两个站点的页面结构手写的（不是录下来的真实页面）；
+没有这个标记的是用 --add 导入的真实快照。另外两个大页面（几 MB）在运行时生成，同样是合成的。
+
+    python bench.py                       # 全部 fixture，每项默认跑 30 次
+    python bench.py -n 100 --only se_     # 只跑文件名含 se_ 的
+    python bench.py --add .state/snapshots/20250101-120000-000001_sportsexperts_page.html.gz --site sportsexperts --expect false
+    python bench.py --soak 3000           # 跑真正的 monitor() 主循环这么多轮，看 RSS 是否平稳
+    python bench.py --parse-scaling 400   # 解析进程池 0/1/2/... 个进程时每秒能解析多少页
+    python bench.py --transport 40        # 本地 TLS 桩（HTTP/1.1 与 HTTP/2）上核对连接复用、TLS 握手、gzip 与 Cookie
+
+--add 可以直接导入 DEBUG=1 时 _debug_save_html 存下的快照（.html 或 .html.gz，首行是 <!-- url --> 注释）。
+全程离线：端到端的 check_stock_* 走本地 HTTP 桩，Sports Experts 预热、Playwright / ScraperAPI 兜底全部关闭。
+"""
+import os
+import io
+import sys
+import json
+import time
+import gzip
+import shutil
+import socket
+import tempfile
+import argparse
+import itertools
+import subprocess
+import threading
+import tracemalloc
+import ssl
+import contextlib
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 在 import main 之前关掉一切可能联网/落盘的配置
+os.environ["DEBUG"] = "0"
+os.environ["STATUS_STORE"] = "none"
+for _k in ("DISCORD_WEBHOOK_URL", "SCRAPERAPI_KEY", "SPORTSEXPERTS_COOKIE"):
+    os.environ.pop(_k, None)
+
+import main
+from bs4 import BeautifulSoup
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures")
+
+# JSON 库存接口的示例站点：fixture 里 "product_path" 是商品页路径，桩按 adapter.endpoint() 换算出的接口路径回放
+main.register_adapter(main.ShopifyJsonAdapter("shopify_example", ("shop.example",)))
+_STUB_DOMAINS = {"sportsexperts": "www.sportsexperts.ca", "trailhead": "www.trailheadpaddleshack.ca"}
+
+# ===== 合成的大页面（几 MB，脚本很多），不入库，运行时生成 =====
+def _synthetic_script(i: int) -> str:
+    """一段 ~2KB 的内联脚本，形状类似打包后的模块 + 序列化状态（带引号、转义、"available" 等干扰词）"""
+    state = ",".join('{"sku":"%d-%d","price":%d.99,"available":%s,"label":"Taille \\u00e9 %d"}'
+                     % (i, j, 20 + j, "true" if (i + j) % 3 else "false", j) for j in range(12))
+    return ("<script>(function(w,d){var m%d={id:%d,deps:['a','b','c'],run:function(e){if(e&&e.type==='click')"
+            "{w.dataLayer=w.dataLayer||[];w.dataLayer.push({event:'tile_%d'});}return '<div class=\"x\">'+e+'</div>';}};"
+            "w.__state__=w.__state__||{};w.__state__['m%d']=JSON.parse('[%s]');d.addEventListener('DOMContentLoaded',m%d.run);"
+            "})(window,document);</script>\n" % (i, i, i, i, state, i))
+
+def _synthetic_script_heavy_se() -> str:
+    chunks = ["<!-- synthetic -->\n<html><head><title>Heavy</title>"]
+    for i in range(2600):
+        chunks.append(_synthetic_script(i))
+    chunks.append("</head><body>")
+    for i in range(4000):
+        chunks.append("<div class='tile'><ul><li><a href='/p/%d'>Product %d</a></li></ul>"
+                      "<button class='btn quick-view'>Quick view</button></div>" % (i, i))
+    chunks.append('<script type="application/ld+json">{"@type":"Product","offers":'
+                  '{"availability":"https://schema.org/InStock"}}</script></body></html>')
+    return "".join(chunks)
+
+def _synthetic_large_trailhead() -> str:
+    filler = "<div class='block'><p>Lorem ipsum dolor sit amet &amp; more</p><a href='#'>link</a></div>" * 25000
+    select = ('<select id="prodattr2">' + "".join(
+        '<option data-color="Black" data-size="%s"%s>Black / %s</option>' % (s, " disabled" if s == "L" else "", s)
+        for s in ["S", "M", "L", "XL"]) + "</select>")
+    scripts = "".join(_synthetic_script(i) for i in range(300))
+    return "<!-- synthetic -->\n<html><head>" + scripts + "</head><body>" + filler + select + filler + "</body></html>"
+
+_SYNTHETIC = {
+    "synthetic_script_heavy_se.html": (_synthetic_script_heavy_se,
+                                       {"site": "sportsexperts", "expected": True}),
+    "synthetic_large_trailhead.html": (_synthetic_large_trailhead,
+                                       {"site": "trailhead", "color": "Black", "sizes": ["M", "L"],
+                                        "expected": {"M": True, "L": False}}),
+}
+
+def load_cases(only: str = None, synthetic: bool = True) -> list:
+    with open(os.path.join(FIXTURE_DIR, "manifest.json"), "r", encoding="utf-8") as f:
+        cases = json.load(f)
+    for case in cases:
+        with open(os.path.join(FIXTURE_DIR, case["file"]), "r", encoding="utf-8") as f:
+            case["html"] = f.read()
+    for name, (build, meta) in (_SYNTHETIC.items() if synthetic else ()):
+        cases.append(dict(meta, file=name, html=build()))
+    if only:
+        cases = [c for c in cases if only in c["file"]]
+    return cases
+
+# ===== 本地 HTTP 桩：按路径回放 fixture =====
+class _StubHandler(BaseHTTPRequestHandler):
+    pages = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = self.pages.get(self.path.split("?")[0])
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        if not isinstance(body, str):   # 迭代器：每次请求轮流回放下一份（浸泡测试里来回切换库存的页面）
+            body = next(body)
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        """浸泡测试里的 Discord webhook：收下就回 204"""
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(204)
+        self.end_headers()
+
+def start_stub(cases: list) -> ThreadingHTTPServer:
+    """每个 fixture 挂在 /<站点域名>/<文件名>，让 http_get 走和线上一样的分支（包括 Incapsula 检测）"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    for case in cases:
+        domain = _STUB_DOMAINS.get(case["site"], case["site"])
+        if "product_path" in case:
+            case["url"] = f"{base}/{domain}/{case['product_path']}"
+            path = urlsplit(main.get_adapter(case["site"]).endpoint(case["url"])).path
+        else:
+            path = f"/{domain}/{case['file']}"
+            case["url"] = base + path
+        _StubHandler.pages[path] = case["html"]
+    threading.Thread(target=server.serve_forever, name="bench-stub", daemon=True).start()
+    return server
+
+def _go_offline():
+    main._sportsexperts_inited = True                    # 不去预热真实站点
+    main._http_get_via_playwright = lambda url: ""       # 不启动浏览器
+    main._http_get_via_scraperapi = lambda url: ""       # 不走代理
+
+# ===== 参照实现（优化前的整树解析）=====
+def _trailhead_reference(html: str, color: str, sizes: list):
+    soup = BeautifulSoup(html, "html.parser")
+    select = soup.find("select", id="prodattr2")
+    options = None if not select else [
+        {"color": o.get("data-color", "").strip(), "size": o.get("data-size", "").strip(), "disabled": o.has_attr("disabled")}
+        for o in select.find_all("option")
+    ]
+    return main.evaluate_trailhead(options, color, sizes)
+
+def _sportsexperts_reference(html: str) -> bool:
+    return main._decide_sportsexperts(html, main._soup_signals(html))
+
+# ===== 计时与内存 =====
+def _percentile(sorted_vals: list, p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * (len(sorted_vals) - 1)))))
+    return sorted_vals[k]
+
+def measure(fn, iterations: int) -> dict:
+    """返回耗时分位数（毫秒）、单次调用的峰值内存与调用后仍留着的内存块数（tracemalloc 单独跑一次，不影响计时）"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn()   # 预热一次，顺便拿结果
+        samples = []
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    retained = sum(s.count_diff for s in after.compare_to(before, "filename") if s.count_diff > 0)
+    samples.sort()
+    return {
+        "result": result,
+        "p50": _percentile(samples, 50), "p90": _percentile(samples, 90),
+        "p99": _percentile(samples, 99), "max": samples[-1] if samples else 0.0,
+        "peak_kb": peak / 1024, "retained": retained,
+    }
+
+def benches_for(case: dict) -> list:
+    """[(函数名, 可调用对象, 是否参与判定比对)]"""
+    html, url = case["html"], case["url"]
+    if case["site"] == "trailhead":
+        color, sizes = case["color"], case["sizes"]
+        return [
+            ("evaluate(parse_trailhead_options)", lambda: main.evaluate_trailhead(main.parse_trailhead_options(html), color, sizes), True),
+            ("reference(BeautifulSoup full)", lambda: _trailhead_reference(html, color, sizes), True),
+            ("check_stock_trailhead(stub)", lambda: main.check_stock_trailhead(url, color, sizes), True),
+        ]
+    if case["site"] != "sportsexperts":
+        # 其他站点（如 JSON 库存接口）：适配器的 parse + evaluate，以及经本地桩走 fetch 的完整路径（不走指纹缓存）
+        adapter = main.get_adapter(case["site"])
+        watch = main.compile_watch({"site": case["site"], "name": case["file"], "url": url,
+                                    "color": case.get("color", ""), "sizes": case.get("sizes", [])}, case["file"])
+        return [
+            (f"{type(adapter).__name__}.parse+evaluate", lambda: adapter.evaluate(watch, adapter.parse(html)), True),
+            (f"{type(adapter).__name__}(stub)", lambda: adapter.evaluate(watch, adapter.parse(adapter.fetch(url))), True),
+        ]
+    soup = BeautifulSoup(html, "html.parser")
+    buttons = soup.find_all(["button", "a", "input"])
+    return [
+        ("parse_sportsexperts_availability", lambda: main.parse_sportsexperts_availability(html), True),
+        ("reference(_soup_signals)", lambda: _sportsexperts_reference(html), True),
+        ("check_stock_sportsexperts(stub)", lambda: main.check_stock_sportsexperts(url), True),
+        ("_parse_inline_json_availability", lambda: main._parse_inline_json_availability(html), False),
+        (f"_is_element_enabled x{len(buttons)}", lambda: [main._is_element_enabled(b) for b in buttons], False),
+    ]
+
+def run(iterations: int, only: str = None) -> int:
+    cases = load_cases(only)
+    if not cases:
+        print("没有匹配的 fixture", flush=True)
+        return 1
+    _go_offline()
+    server = start_stub(cases)
+    mismatches = 0
+    try:
+        print(f"{'fixture':<34} {'function':<36} {'p50ms':>8} {'p90ms':>8} {'p99ms':>8} {'maxms':>8} "
+              f"{'peakKB':>9} {'retained':>8}  verdict", flush=True)
+        for case in cases:
+            for name, fn, compare in benches_for(case):
+                m = measure(fn, iterations)
+                verdict = ""
+                if compare:
+                    ok = m["result"] == case["expected"]
+                    verdict = "ok" if ok else f"MISMATCH got={m['result']!r} expected={case['expected']!r}"
+                    mismatches += 0 if ok else 1
+                print(f"{case['file'][:34]:<34} {name[:36]:<36} {m['p50']:>8.2f} {m['p90']:>8.2f} {m['p99']:>8.2f} "
+                      f"{m['max']:>8.2f} {m['peak_kb']:>9.1f} {m['retained']:>8}  {verdict}", flush=True)
+    finally:
+        server.shutdown()
+    print(f"\n判定不一致: {mismatches}", flush=True)
+    return 1 if mismatches else 0
+
+# ===== 浸泡测试：长时间反复跑 run_cycle，RSS 应该持平 =====
+class _SoakDone(Exception):
+    pass
+
+def soak(cycles: int, every: int, only: str = None) -> int:
+    """
+    用入库的 fixture 当关注列表跑真正的 monitor() 主循环：调度器、sqlite 状态库提交、Discord 队列都在内。
+    检查间隔与 host 预算全部置 0，页面一完成就重新到期（每次都完整解析，不走指纹缓存）；一轮 = 每个页面各完成一次。
+    另挂一个在有货/无货之间来回切换的页面，每轮都有通知经 Discord 队列发到本地桩；
+    关注列表文件每 every 轮换掉其中一项的 URL，覆盖热加载时的状态清理。
+    每 every 轮采一次 RSS；跳过前 10% 的预热后，增长超过 max(8MB, 10%) 判为泄漏。
+    """
+    cases = load_cases(only, synthetic=False)
+    _go_offline()
+    server = start_stub(cases)
+    base = cases[0]["url"].split("/", 3)
+    base = f"{base[0]}//{base[2]}"
+    entries = [{"site": c["site"], "name": c["file"], "url": c["url"],
+                "color": c.get("color", ""), "sizes": c.get("sizes", [])} for c in cases]
+    bodies = {c["file"]: c["html"] for c in cases}
+    if "se_in_stock_jsonld.html" in bodies and "se_sold_out_jsonld.html" in bodies:
+        _StubHandler.pages["/www.sportsexperts.ca/flapping.html"] = itertools.cycle(
+            [bodies["se_in_stock_jsonld.html"], bodies["se_sold_out_jsonld.html"]])
+        entries.append({"site": "sportsexperts", "name": "flapping", "url": f"{base}/www.sportsexperts.ca/flapping.html",
+                        "color": "", "sizes": []})
+
+    workdir = tempfile.mkdtemp(prefix="bench-soak-")
+    watch_path = os.path.join(workdir, "watch.json")
+
+    def write_watchlist(generation: int):
+        churn = dict(entries[0], name=f"churn-{generation}", url=f"{entries[0]['url']}?v={generation}")
+        with open(watch_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entries + [churn], f)
+        os.replace(watch_path + ".tmp", watch_path)
+
+    write_watchlist(0)
+    pages = len({(e["site"], e["url"]) for e in entries}) + 1
+    main.WATCHLIST, main.WATCHLIST_RELOAD_SEC = watch_path, 0
+    main.INTERVAL_SEC = main.MIN_INTERVAL_SEC = 0
+    main.HOST_BUDGET_PER_MIN = 0
+    main.FINGERPRINT_MAX_AGE_SEC = 0
+    main._DISCORD = main._DiscordDelivery(f"{base}/discord", os.path.join(workdir, "discord_spool.json"))
+    store = main._SqliteStatusStore(os.path.join(workdir, "status.sqlite3"))
+
+    samples, done = [], [0]
+    apply_page_result = main.apply_page_result
+
+    def counted(*args, **kwargs):
+        records = apply_page_result(*args, **kwargs)
+        done[0] += 1
+        if done[0] % pages == 0:
+            i = done[0] // pages - 1
+            if i % every == 0 or i == cycles - 1:
+                samples.append((i, main._process_rss_mb()))
+                print(f"cycle {i:>6}  RSS {samples[-1][1]:.1f}MB", file=sys.__stdout__, flush=True)
+            if i % every == every - 1:
+                write_watchlist(i + 1)
+            if i == cycles - 1:
+                raise _SoakDone()
+        return records
+
+    main.apply_page_result = counted
+    started = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as sink, contextlib.redirect_stdout(sink):
+            try:
+                main.monitor(store)
+            except _SoakDone:
+                pass
+            finally:
+                main._get_executor().shutdown(wait=True)   # 在途的页面先抓完，再停桩
+                main._DISCORD.flush(10)
+    finally:
+        main.apply_page_result = apply_page_result
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    elapsed = time.perf_counter() - started
+
+    steady = [rss for i, rss in samples if i >= cycles // 10] or [samples[-1][1]]
+    base_rss, end, peak = steady[0], steady[-1], max(steady)
+    growth = end - base_rss
+    leaked = growth > max(8.0, base_rss * 0.10)
+    print(f"\n{cycles} 轮 x {pages} 个页面，用时 {elapsed:.1f}s（{cycles * pages / elapsed:.0f} 页/秒）", flush=True)
+    print(f"预热后 RSS {base_rss:.1f}MB -> {end:.1f}MB（峰值 {peak:.1f}MB，增长 {growth:+.1f}MB）: {'疑似泄漏' if leaked else '平稳'}", flush=True)
+    return 1 if leaked else 0
+
+# ===== 解析进程池扩展性：不同进程数下每秒解析多少页 =====
+def parse_scaling(pages: int, max_workers: int, only: str = None) -> int:
+    """
+    按 MAX_WORKERS 个抓取线程并发把 fixture 轮流交给 main.parse_page，
+    解析进程数从 0（线程内解析）加到 max_workers，输出页/秒并校验结果与线程内解析一致。
+    """
+    cases = load_cases(only)
+    adapters = [main.get_adapter(c["site"]) for c in cases]
+    expected = [a.parse(c["html"]) for a, c in zip(adapters, cases)]
+    print(f"{len(cases)} 个 fixture，{pages} 页/组，{main.MAX_WORKERS} 个抓取线程，CPU {os.cpu_count()} 核", flush=True)
+
+    def parse_one(i):
+        i %= len(cases)
+        return i, main.parse_page(adapters[i], cases[i]["html"])
+
+    mismatches, baseline = 0, None
+    for workers in range(0, max_workers + 1):
+        pool = main._ParsePool(workers, max(main.PARSE_QUEUE_SIZE, workers * 2), main.PARSE_MAX_TASKS_PER_CHILD) if workers else None
+        main._PARSE_POOL = pool
+        try:
+            with main.ThreadPoolExecutor(main.MAX_WORKERS) as ex:
+                list(ex.map(parse_one, range(len(cases))))   # 预热：子进程 spawn + import 不计入耗时
+                started = time.perf_counter()
+                results = list(ex.map(parse_one, range(pages)))
+                elapsed = time.perf_counter() - started
+        finally:
+            main._PARSE_POOL = None
+            if pool is not None:
+                pool.close()
+        bad = sum(1 for i, r in results if r != expected[i])
+        mismatches += bad
+        rate = pages / elapsed
+        baseline = baseline or rate
+        label = "线程内" if workers == 0 else f"{workers} 进程"
+        print(f"{label:<8} {rate:8.1f} 页/秒  x{rate / baseline:.2f}" + (f"  结果不一致 {bad}" if bad else ""), flush=True)
+    print(f"\n判定不一致: {mismatches}", flush=True)
+    return 1 if mismatches else 0
+
+# ===== 传输层：本地 TLS 桩上核对连接复用与握手次数 =====
+_TLS_BODY = b"<html>" + b"<p>padding</p>" * 4000 + b"</html>"
+
+class _TlsStubHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive，按 Accept-Encoding 回 gzip，并下发一个 Cookie"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        gz = "gzip" in self.headers.get("Accept-Encoding", "")
+        data = gzip.compress(_TLS_BODY) if gz else _TLS_BODY
+        self.send_response(200)
+        if gz:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Set-Cookie", "sid=h1; Path=/")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+async def _tls_stub_app(scope, receive, send):
+    """同样的响应，给 hypercorn（HTTP/2）用的 ASGI 版本"""
+    gz = b"gzip" in dict(scope["headers"]).get(b"accept-encoding", b"")
+    data = gzip.compress(_TLS_BODY) if gz else _TLS_BODY
+    headers = [(b"content-length", str(len(data)).encode()), (b"set-cookie", b"sid=h2; Path=/")]
+    if gz:
+        headers.append((b"content-encoding", b"gzip"))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    await send({"type": "http.response.body", "body": data})
+
+def _self_signed_cert(workdir: str):
+    """用 openssl 命令行签一张 CN/SAN=localhost 的自签证书，返回 (cert, key)；没有 openssl 返回 None"""
+    cert, key = os.path.join(workdir, "stub.crt"), os.path.join(workdir, "stub.key")
+    try:
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-keyout", key, "-out", cert, "-subj", "/CN=localhost",
+                        "-addext", "subjectAltName=DNS:localhost"],
+                       check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"无法生成自签证书（{e}），跳过传输层检查", flush=True)
+        return None
+    return cert, key
+
+def _start_tls_h1(cert: str, key: str):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _TlsStubHandler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+def _start_tls_h2(cert: str, key: str):
+    """hypercorn 起一个只在 ALPN 上优先 h2 的桩；没装 hypercorn 返回 None"""
+    try:
+        import asyncio
+        from hypercorn.config import Config
+        from hypercorn.asyncio import serve
+    except ImportError:
+        return None
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.certfile, config.keyfile = cert, key
+    config.alpn_protocols = ["h2", "http/1.1"]
+    config.loglevel = "ERROR"
+    # 在线程里跑：不能装信号处理，用一个永不触发的 shutdown_trigger 代替
+    threading.Thread(target=lambda: asyncio.run(serve(_tls_stub_app, config, shutdown_trigger=lambda: asyncio.Event().wait())),
+                     daemon=True).start()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return port
+        except OSError:
+            time.sleep(0.05)
+    return None
+
+def _transport_case(label: str, url: str, requests_n: int, http2: bool) -> int:
+    """
+    用一个新的 _Transport 跑三段请求（串行、并发、流式读完），对照 cycle_report 核对：
+    新建连接数不超过并发数（HTTP/2 为 1），每条连接恰好一次 TLS 握手，gzip 被解开，Cookie 进了 Session。
+    """
+    transport = main._Transport(main.HTTP_POOL_MAXSIZE, {}, main.DNS_CACHE_SEC, ["localhost"] if http2 else [])
+    main._TRANSPORT = transport          # 适配器按全局名计数
+    session = transport.session(main.HEADERS)
+    threads = min(4, requests_n)
+    problems = []
+    try:
+        r = session.get(url, timeout=main.REQUEST_TIMEOUT)
+        if r.content != _TLS_BODY:
+            problems.append("响应体与桩不一致")
+        if "gzip" not in r.headers.get("Content-Encoding", ""):
+            problems.append("未协商 gzip")
+        if not session.cookies.get("sid"):
+            problems.append("Cookie 没进 Session")
+        for _ in range(requests_n):
+            main._read_body(session.get(url, timeout=main.REQUEST_TIMEOUT, stream=True))
+        with main.ThreadPoolExecutor(threads) as ex:
+            list(ex.map(lambda _: session.get(url, timeout=main.REQUEST_TIMEOUT).content, range(requests_n)))
+        totals = dict(transport._totals)
+        report = transport.cycle_report()
+    finally:
+        session.close()         # 连带关掉两个适配器的连接池
+    max_conns = 1 if http2 else threads
+    if totals["connections"] > max_conns:
+        problems.append(f"新建连接 {totals['connections']} > {max_conns}")
+    if totals["handshakes"] != totals["connections"]:
+        problems.append(f"TLS 握手 {totals['handshakes']} != 新建连接 {totals['connections']}")
+    print(f"{label:<10} {report}  " + ("ok" if not problems else "不符: " + "；".join(problems)), flush=True)
+    return len(problems)
+
+def transport_check(requests_n: int) -> int:
+    """本地 TLS 桩上核对 _Transport 的连接复用 / 握手计数：HTTP/1.1 必跑，HTTP/2 需要 hypercorn 与 httpx[http2]"""
+    saved = main._TRANSPORT, os.environ.get("REQUESTS_CA_BUNDLE")
+    problems = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        pair = _self_signed_cert(workdir)
+        if pair is None:
+            return 0
+        os.environ["REQUESTS_CA_BUNDLE"] = pair[0]
+        try:
+            port = _start_tls_h1(*pair)
+            problems += _transport_case("HTTP/1.1", f"https://localhost:{port}/p", requests_n, http2=False)
+            port = _start_tls_h2(*pair)
+            if port is None:
+                print("HTTP/2     跳过：未安装 hypercorn", flush=True)
+            elif main._Transport._http2_adapter() is None:
+                print("HTTP/2     跳过：未安装 httpx[http2]", flush=True)
+            else:
+                problems += _transport_case("HTTP/2", f"https://localhost:{port}/p", requests_n, http2=True)
+        finally:
+            main._TRANSPORT = saved[0]
+            if saved[1] is None:
+                os.environ.pop("REQUESTS_CA_BUNDLE", None)
+            else:
+                os.environ["REQUESTS_CA_BUNDLE"] = saved[1]
+    print(f"\n传输层不符: {problems}", flush=True)
+    return 1 if problems else 0
+
+def add_fixture(path: str, site: str, expect: str, color: str, sizes: list):
+    """把一份快照（.html 或 DEBUG 快照的 .html.gz）加进 fixture 目录与 manifest"""
+    name = os.path.basename(path)
+    opener = gzip.open if name.endswith(".gz") else open
+    name = name[:-3] if name.endswith(".gz") else name
+    with opener(path, "rt", encoding="utf-8") as src, open(os.path.join(FIXTURE_DIR, name), "w", encoding="utf-8") as dst:
+        dst.write(src.read())
+    manifest_path = os.path.join(FIXTURE_DIR, "manifest.json")
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    entry = {"file": name, "site": site, "expected": json.loads(expect)}     # 真实快照，不带 "synthetic"
+    if site == "trailhead":
+        entry.update(color=color, sizes=sizes)
+    manifest.append(entry)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        f.write("[\n" + ",\n".join("  " + json.dumps(e, ensure_ascii=False) for e in manifest) + "\n]\n")
+    print(f"已添加 fixture: {name}", flush=True)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="离线解析基准 + 判定一致性校验")
+    ap.add_argument("-n", "--iterations", type=int, default=30)
+    ap.add_argument("--only", help="只跑文件名包含该字符串的 fixture")
+    ap.add_argument("--add", metavar="HTML", help="导入一份页面快照作为 fixture")
+    ap.add_argument("--site", choices=["trailhead", "sportsexperts"])
+    ap.add_argument("--expect", help='期望判定（JSON），如 true 或 \'{"M": true}\'')
+    ap.add_argument("--color", default="")
+    ap.add_argument("--sizes", default="", help="逗号分隔的尺码")
+    ap.add_argument("--soak", type=int, metavar="CYCLES", help="浸泡测试：跑这么多轮 run_cycle 并采样 RSS")
+    ap.add_argument("--sample-every", type=int, default=100, help="浸泡测试每多少轮采一次 RSS")
+    ap.add_argument("--parse-scaling", type=int, metavar="PAGES", help="解析进程池扩展性：每种进程数解析这么多页")
+    ap.add_argument("--max-parse-workers", type=int, default=os.cpu_count() or 1, help="扩展性测试最多用几个解析进程")
+    ap.add_argument("--transport", type=int, metavar="REQUESTS", help="本地 TLS 桩上核对连接复用与握手：每段发这么多请求")
+    args = ap.parse_args()
+
+    if args.add:
+        if not args.site or args.expect is None:
+            ap.error("--add 需要同时给出 --site 与 --expect")
+        add_fixture(args.add, args.site, args.expect, args.color, [s for s in args.sizes.split(",") if s])
+        sys.exit(0)
+    if args.soak:
+        sys.exit(soak(args.soak, max(1, args.sample_every), args.only))
+    if args.transport:
+        sys.exit(transport_check(args.transport))
+    if args.parse_scaling:
+        sys.exit(parse_scaling(args.parse_scaling, max(1, args.max_parse_workers), args.only))
+    sys.exit(run(args.iterations, args.only))
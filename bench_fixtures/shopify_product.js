@@ -0,0 +1 @@
+{"id":7301234567890,"title":"Heliad 15 Backpack","handle":"heliad-15-backpack","vendor":"Arc'teryx","type":"Backpacks","tags":["packs"],"options":[{"name":"Color","position":1,"values":["Black","Stone Green"]},{"name":"Size","position":2,"values":["S","M","L"]}],"variants":[{"id":41000000000001,"title":"Black / S","option1":"Black","option2":"S","option3":null,"available":true,"price":11000},{"id":41000000000002,"title":"Black / M","option1":"Black","option2":"M","option3":null,"available":false,"price":11000},{"id":41000000000003,"title":"Black / L","option1":"Black","option2":"L","option3":null,"available":true,"price":11000},{"id":41000000000004,"title":"Stone Green / S","option1":"Stone Green","option2":"S","option3":null,"available":false,"price":11000},{"id":41000000000005,"title":"Stone Green / M","option1":"Stone Green","option2":"M","option3":null,"available":false,"price":11000},{"id":41000000000006,"title":"Stone Green / L","option1":"Stone Green","option2":"L","option3":null,"available":false,"price":11000}]}
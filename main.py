@@ -1,10 +1,44 @@
 import os
 import re
+import sys
 import json
 import time
+import heapq
+import random
+import sqlite3
+import hashlib
+import atexit
+import asyncio
+import threading
+import bisect
+import signal
+import socket
+import ssl
+import contextlib
+import subprocess
+import multiprocessing
+import codecs
+import gzip
+import queue
 import datetime as dt
+from email.utils import parsedate_to_datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from zoneinfo import ZoneInfo
 import requests
-from requests.cookies import create_cookie
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.cookies import create_cookie, extract_cookies_to_jar
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError, NameResolutionError
+from urllib3.util import connection as _u3_connection
+from urllib3.util.ssl_ import is_ipaddress
 from bs4 import BeautifulSoup, element
 
 # ===== 环境变量 =====
@@ -15,6 +49,10 @@ DEBUG           = os.getenv("DEBUG", "0") == "1"
 SPORTSEXPERTS_COOKIE = os.getenv("SPORTSEXPERTS_COOKIE", "").strip()
 AGGRESSIVE_ATC_FALLBACK = os.getenv("AGGRESSIVE_ATC_FALLBACK", "0") == "1"
 
+# 并发检查：总线程数 + 每个站点（host）同时在途的请求数
+MAX_WORKERS          = int(os.getenv("MAX_WORKERS", "8"))
+PER_HOST_CONCURRENCY = int(os.getenv("PER_HOST_CONCURRENCY", "2"))
+
 # 可留空：若以后想再加代理兜底，填 SCRAPERAPI_KEY 即可自动启用（顺序：Playwright -> ScraperAPI）
 SCRAPERAPI_KEY  = os.getenv("SCRAPERAPI_KEY", "").strip()
 
@@ -22,6 +60,89 @@ SCRAPERAPI_KEY  = os.getenv("SCRAPERAPI_KEY", "").strip()
 PLAYWRIGHT_HEADLESS = os.getenv("PLAYWRIGHT_HEADLESS", "1") == "1"
 PLAYWRIGHT_TIMEOUT_MS = int(os.getenv("PLAYWRIGHT_TIMEOUT_MS", str(REQUEST_TIMEOUT * 1000)))
 PLAYWRIGHT_EXTRA_WAIT_MS = int(os.getenv("PLAYWRIGHT_EXTRA_WAIT_MS", "1200"))
+# 常驻浏览器池：预热的 context 数量、每个 context 用多少次后重建、浏览器总内存上限（MB，0 为不限）
+PLAYWRIGHT_POOL_SIZE     = int(os.getenv("PLAYWRIGHT_POOL_SIZE", "2"))
+PLAYWRIGHT_CONTEXT_MAX_USES = int(os.getenv("PLAYWRIGHT_CONTEXT_MAX_USES", "50"))
+PLAYWRIGHT_MAX_RSS_MB    = int(os.getenv("PLAYWRIGHT_MAX_RSS_MB", "1024"))
+# 精简渲染：拦截图片/字体/样式/媒体和常见追踪域名，等到库存信号节点出现就取 HTML（不再 networkidle + 固定等待）
+PLAYWRIGHT_LEAN          = os.getenv("PLAYWRIGHT_LEAN", "1") == "1"
+PLAYWRIGHT_READY_TIMEOUT_MS = int(os.getenv("PLAYWRIGHT_READY_TIMEOUT_MS", "15000"))
+
+# 本地状态目录（浏览器 Cookie 等需要跨重启保留的东西）
+STATE_DIR = os.getenv("STATE_DIR", ".state")
+# 浏览器拿到的会话 Cookie（无过期时间）落盘后最多再用多久（秒）
+COOKIE_SESSION_TTL_SEC = int(os.getenv("COOKIE_SESSION_TTL_SEC", str(6 * 3600)))
+
+# 出站连接：零售商、ScraperAPI、Discord 共用一层传输（连接池 + keep-alive）。
+# HTTP_POOL_SIZES 按 host 指定连接池大小，如 "www.sportsexperts.ca=2,discord.com=1"，未列出的用 HTTP_POOL_MAXSIZE；
+# DNS 解析结果缓存多少秒（0 为不缓存）；HTTP2_HOSTS 里的 host（逗号分隔，"*" 为全部）在装了 httpx[http2] 时走 HTTP/2。
+# 压缩按已安装的解码器协商（gzip / deflate，装了 brotli 时加上 br）
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "0")) or max(10, MAX_WORKERS)
+HTTP_POOL_SIZES   = os.getenv("HTTP_POOL_SIZES", "").strip()
+DNS_CACHE_SEC     = float(os.getenv("DNS_CACHE_SEC", "300"))
+HTTP2_HOSTS       = os.getenv("HTTP2_HOSTS", "").strip()
+
+# 重试与熔断：单次 http_get 内最多试几次；某 host 连续失败几次或遇到 429/503 后暂停多久（秒）
+HTTP_ATTEMPTS        = int(os.getenv("HTTP_ATTEMPTS", "3"))
+BREAKER_FAILURES     = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN_SEC = int(os.getenv("BREAKER_COOLDOWN_SEC", "300"))
+RETRY_AFTER_MAX_SEC  = int(os.getenv("RETRY_AFTER_MAX_SEC", "3600"))
+
+# 自适应调度：刚变过状态/抢购时段加密，长期不变或连续失败放缓；按 host 限总请求速率
+MIN_INTERVAL_SEC       = int(os.getenv("MIN_INTERVAL_SEC", "60"))
+MAX_INTERVAL_SEC       = int(os.getenv("MAX_INTERVAL_SEC", str(INTERVAL_SEC * 4)))
+HOT_WINDOW_SEC         = int(os.getenv("HOT_WINDOW_SEC", "7200"))          # 状态变化后多久内算“热”
+HOT_INTERVAL_FACTOR    = float(os.getenv("HOT_INTERVAL_FACTOR", "0.25"))
+STABLE_AFTER_SEC       = int(os.getenv("STABLE_AFTER_SEC", str(3 * 86400)))  # 多久没变化算“稳定”
+STABLE_INTERVAL_FACTOR = float(os.getenv("STABLE_INTERVAL_FACTOR", "2"))
+SCHEDULE_JITTER        = float(os.getenv("SCHEDULE_JITTER", "0.1"))        # ±10% 随机抖动
+HOST_BUDGET_PER_MIN    = float(os.getenv("HOST_BUDGET_PER_MIN", "30"))     # 每个 host 每分钟最多检查几个页面，0 为不限
+# 抢购时段（本地时间），如 "Tue,Thu 09:00-11:00; 20:00-21:00"，不写星期表示每天
+DROP_WINDOWS    = os.getenv("DROP_WINDOWS", "").strip()
+DROP_WINDOWS_TZ = os.getenv("DROP_WINDOWS_TZ", "America/Toronto")
+
+# 状态持久化：sqlite（默认）/ file（追加写 JSON Lines，定期压缩）/ none（只在内存）
+STATUS_STORE = os.getenv("STATUS_STORE", "sqlite").strip().lower()
+STATUS_FILE_COMPACT_LINES = int(os.getenv("STATUS_FILE_COMPACT_LINES", "5000"))
+
+# 页面库存片段指纹不变时复用上次解析结果；超过这个时间（秒）强制完整解析一次
+FINGERPRINT_MAX_AGE_SEC = int(os.getenv("FINGERPRINT_MAX_AGE_SEC", "3600"))
+
+# 流式抓取：边下载边找库存信号，信号完整后立即断开，不再下载页面剩余部分（找不到就照常读完整页）
+STREAM_FETCH       = os.getenv("STREAM_FETCH", "1") == "1"
+STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", "16384"))
+# 提前断开时，剩余（未解压）字节不超过这个数就读完丢弃，让连接回到连接池；超过才真的断开
+STREAM_DRAIN_MAX_BYTES = int(os.getenv("STREAM_DRAIN_MAX_BYTES", str(256 * 1024)))
+
+# 解析进程池：PARSE_WORKERS > 0 时，CPU 密集的页面解析（Sports Experts）交给子进程，抓取线程只管网络 I/O；
+# 同时在解析的页面数上限（满了抓取线程就等），以及每个子进程解析多少页后换新
+PARSE_WORKERS             = int(os.getenv("PARSE_WORKERS", "0"))
+PARSE_QUEUE_SIZE          = int(os.getenv("PARSE_QUEUE_SIZE", "0")) or max(1, PARSE_WORKERS) * 2
+PARSE_MAX_TASKS_PER_CHILD = int(os.getenv("PARSE_MAX_TASKS_PER_CHILD", "500"))
+
+# 内存上限：单个响应体最多读多少字节（超出的部分不读）；DEBUG 页面快照压缩后存进 STATE_DIR/snapshots，
+# 总大小超过 DEBUG_SNAPSHOT_MAX_MB 就删最旧的
+MAX_BODY_BYTES        = int(os.getenv("MAX_BODY_BYTES", str(8 * 1024 * 1024)))
+DEBUG_SNAPSHOT_MAX_MB = float(os.getenv("DEBUG_SNAPSHOT_MAX_MB", "20"))
+
+# 指标：METRICS_PORT 非 0 时在本地提供 Prometheus 文本格式的 /metrics
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 慢批次剖析：批次耗时超过该秒数时打印采样到的热点函数（0 为关闭）；采样间隔（毫秒）
+PROFILE_SLOW_CYCLE_SEC = float(os.getenv("PROFILE_SLOW_CYCLE_SEC", "0"))
+PROFILE_INTERVAL_MS    = int(os.getenv("PROFILE_INTERVAL_MS", "10"))
+
+# 分片：用 --worker 启动时，多个 worker 共用 SHARD_DB 这个 SQLite 协调文件，按 URL 一致性哈希分摊关注列表；
+# --workers N 在本机起 N 个 worker。心跳租约超过 SHARD_LEASE_SEC 没续约的 worker 视为下线。
+# 每个 worker 的 Discord 待发队列与 Cookie 文件按 WORKER_ID 分开，单独部署 worker 时请给固定的 WORKER_ID，重启后才能接着发
+SHARD_DB        = os.getenv("SHARD_DB", os.path.join(STATE_DIR, "shard.sqlite3"))
+WORKER_ID       = os.getenv("WORKER_ID", "").strip() or f"{socket.gethostname()}-{os.getpid()}"
+SHARD_LEASE_SEC = float(os.getenv("SHARD_LEASE_SEC", "60"))
+SHARD_VNODES    = int(os.getenv("SHARD_VNODES", "64"))
+
+# 关注列表：YAML / JSON / TOML 文件或目录（留空则用下面内置的 PRODUCTS）；每隔多少秒检查一次文件是否有改动
+WATCHLIST            = os.getenv("WATCHLIST", "").strip()
+WATCHLIST_RELOAD_SEC = float(os.getenv("WATCHLIST_RELOAD_SEC", "5"))
 
 HEADERS = {
     "User-Agent": ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -33,7 +154,7 @@ HEADERS = {
     "Pragma": "no-cache",
 }
 
-# ===== 商品清单 =====
+# ===== 商品清单（未配置 WATCHLIST 时使用）=====
 PRODUCTS = [
     # ----- trailhead -----
     {"site":"trailhead","name":"Arc'teryx Covert Cardigan Men's","url":"https://www.trailheadpaddleshack.ca/arcteryx-covert-cardigan-mens.html?id=113476423&quantity=1","color":"Cloud Heather / Void","sizes":["S","M","L"]},
@@ -48,12 +169,498 @@ PRODUCTS = [
     {"site":"sportsexperts","name":"Arc'teryx Rho Zip Neck - Women's Baselayer Long-Sleeved Shirt","url":"https://www.sportsexperts.ca/en-CA/p-rho-zipneck-womens-baselayer-long-sleeved-shirt/668324/","color":"Black","sizes":[]},
 ]
 
+# ===== 指标：计时 span、计数器、仪表，/metrics 以 Prometheus 文本格式输出 =====
+_METRIC_PREFIX = "stockbot_"
+_METRIC_HELP = {
+    "span_seconds":                 ("histogram", "各环节耗时（fetch / 兜底渲染 / 解析 / 判定步骤 / Discord 发送）"),
+    "http_bytes_total":             ("counter",   "下载的响应体字节数"),
+    "http_requests_total":          ("counter",   "发出的 HTTP 请求数（按状态码）"),
+    "http_retries_total":           ("counter",   "http_get 内的重试次数"),
+    "http_pool_requests_total":     ("counter",   "经传输层发出的请求数（零售商 / ScraperAPI / Discord，按 host 与协议）"),
+    "http_connections_opened_total":("counter",   "新建的 TCP 连接数（其余请求都复用了已有连接）"),
+    "http_tls_handshakes_total":    ("counter",   "TLS 握手次数"),
+    "http_content_encoding_total":  ("counter",   "响应的 Content-Encoding（identity 为未压缩）"),
+    "dns_lookups_total":            ("counter",   "DNS 解析（hit 为命中缓存）"),
+    "block_page_hits_total":        ("counter",   "命中 Incapsula 拦截页的次数"),
+    "fallback_total":               ("counter",   "兜底渲染调用次数（playwright / scraperapi，按结果）"),
+    "page_cache_hits_total":        ("counter",   "跳过解析的次数（304 / 指纹未变）"),
+    "stream_stops_total":           ("counter",   "流式抓取在信号到手后提前断开的次数"),
+    "body_truncated_total":         ("counter",   "响应体超过 MAX_BODY_BYTES 被截断的次数"),
+    "debug_snapshots_dropped_total":("counter",   "DEBUG 快照写盘跟不上而丢弃的份数"),
+    "process_rss_bytes":            ("gauge",     "本进程常驻内存（每批检查后采样）"),
+    "browser_rss_bytes":            ("gauge",     "Playwright 浏览器子进程常驻内存合计"),
+    "sportsexperts_decisions_total":("counter",   "Sports Experts 判定落在哪一步"),
+    "discord_posts_total":          ("counter",   "Discord webhook 请求数（按结果）"),
+    "slow_cycles_total":            ("counter",   "超过 PROFILE_SLOW_CYCLE_SEC 的批次数"),
+    "cycle_duration_seconds":       ("gauge",     "最近一批检查的耗时"),
+    "cycle_pages":                  ("gauge",     "最近一批检查的页面数"),
+    "schedule_lag_seconds":         ("gauge",     "最近一批到期页面实际开始检查时比预定时间晚了多久（最大值）"),
+    "discord_queue_depth":          ("gauge",     "Discord 待发通知条数"),
+    "parse_pool_inflight":          ("gauge",     "交给解析进程池、还没返回的页面数"),
+    "parse_pool_wait_seconds":      ("histogram", "抓取线程等解析进程池空位的时间（背压）"),
+    "parse_pool_restarts_total":    ("counter",   "解析进程池崩溃后重建的次数"),
+    "shard_members":                ("gauge",     "在线 worker 数"),
+    "shard_owned_watches":          ("gauge",     "本 worker 负责的关注项数"),
+    "shard_alerts_deduped_total":   ("counter",   "被协调者判为重复而丢弃的通知"),
+}
+_SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class _Metrics:
+    """进程内指标，线程安全；标签用关键字参数传入，取值都当字符串"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)   # (name, labels) -> value
+        self._gauges = {}
+        self._hists = {}                      # (name, labels) -> [各桶计数, sum, count]
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [[0] * len(_SPAN_BUCKETS), 0.0, 0]
+            for i, bound in enumerate(_SPAN_BUCKETS):
+                if value <= bound:
+                    h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    @contextlib.contextmanager
+    def span(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("span_seconds", time.perf_counter() - started, span=name, **labels)
+
+    def snapshot(self) -> tuple:
+        """计数器与直方图的副本（可 pickle）：解析子进程把每页的指标带回父进程 merge"""
+        with self._lock:
+            return dict(self._counters), {k: (list(v[0]), v[1], v[2]) for k, v in self._hists.items()}
+
+    def merge(self, snapshot: tuple):
+        counters, hists = snapshot
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] += value
+            for key, (buckets, total, count) in hists.items():
+                h = self._hists.get(key)
+                if h is None:
+                    h = self._hists[key] = [[0] * len(_SPAN_BUCKETS), 0.0, 0]
+                h[0] = [a + b for a, b in zip(h[0], buckets)]
+                h[1] += total
+                h[2] += count
+
+    def render(self) -> str:
+        with self._lock:
+            series = defaultdict(list)
+            for (name, labels), v in self._counters.items():
+                series[name].append((labels, v))
+            for (name, labels), v in self._gauges.items():
+                series[name].append((labels, v))
+            hists = {k: (list(v[0]), v[1], v[2]) for k, v in self._hists.items()}
+        for (name, labels), h in hists.items():
+            series[name].append((labels, h))
+
+        lines = []
+        for name in sorted(series):
+            kind, help_text = _METRIC_HELP.get(name, ("untyped", ""))
+            full = _METRIC_PREFIX + name
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, v in sorted(series[name], key=lambda s: s[0]):
+                if kind != "histogram":
+                    lines.append(f"{full}{_format_labels(labels)} {v:g}")
+                    continue
+                buckets, total, count = v
+                for bound, n in zip(_SPAN_BUCKETS, buckets):
+                    lines.append(f"{full}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {n}")
+                lines.append(f"{full}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{full}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    esc = lambda s: str(s).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+METRICS = _Metrics()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = METRICS.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    """在后台线程里提供 /metrics；port 为 0 时不启动，返回 server（或 None）"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"指标端口 {host}:{port} 启动失败: {e}", flush=True)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"指标: http://{host}:{server.server_address[1]}/metrics", flush=True)
+    return server
+
+class _StackSampler:
+    """
+    采样式剖析：每 interval 秒抓一次检查线程（与主线程）的调用栈，按函数累计出现次数。
+    只在批次超过 PROFILE_SLOW_CYCLE_SEC 时打印，平时开销就是一个低频线程。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._samples = 0
+        self._counts = defaultdict(int)   # "函数 (文件:行)" -> 出现在多少次采样的栈里
+
+    def start(self):
+        self._stop.clear()
+        self._samples = 0
+        self._counts.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        watched = lambda t: t is threading.main_thread() or t.name.startswith("check")
+        while not self._stop.wait(self.interval):
+            idents = {t.ident for t in threading.enumerate() if watched(t)}
+            for ident, frame in sys._current_frames().items():
+                if ident not in idents:
+                    continue
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    seen.add(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                for name in seen:
+                    self._counts[name] += 1
+                self._samples += 1
+
+    def report(self, top: int = 15) -> str:
+        if not self._samples:
+            return "（没有采到样本）"
+        rows = sorted(self._counts.items(), key=lambda kv: -kv[1])[:top]
+        return "\n".join(f"  {n * 100 / self._samples:5.1f}%  {name}" for name, n in rows)
+
+# ===== 出站传输层：所有对外 HTTP 共用连接池、DNS 缓存与连接统计 =====
+def _parse_pool_sizes(raw: str) -> dict:
+    sizes = {}
+    for item in filter(None, (x.strip() for x in raw.split(","))):
+        host, _, n = item.partition("=")
+        try:
+            sizes[host.strip().lower()] = max(1, int(n))
+        except ValueError:
+            print(f"HTTP_POOL_SIZES 配置有误，忽略: {item}", flush=True)
+    return sizes
+
+class _TrackedConnectionMixin:
+    """建连时走传输层的 DNS 缓存，并记一次新建连接"""
+
+    def _new_conn(self):
+        try:
+            addrs = _TRANSPORT.resolve(self._dns_host, self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(self.host, self, e) from e
+        if addrs is None:   # IP 直连或关闭了 DNS 缓存：交给 urllib3 原逻辑
+            sock = super()._new_conn()
+        else:
+            sock = self._connect_any(addrs)
+        _TRANSPORT.count("connections", self.host)
+        return sock
+
+    def _connect_any(self, addrs: list):
+        err = None
+        for ip in addrs:
+            try:
+                return _u3_connection.create_connection(
+                    (ip, self.port), self.timeout,
+                    source_address=self.source_address, socket_options=self.socket_options,
+                )
+            except OSError as e:
+                err = e
+        # 缓存的地址全都连不上：丢掉缓存，下次重新解析
+        _TRANSPORT.forget(self._dns_host, self.port)
+        if isinstance(err, TimeoutError):
+            raise ConnectTimeoutError(self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})") from err
+        raise NewConnectionError(self, f"Failed to establish a new connection: {err}") from err
+
+class _TrackedHTTPConnection(_TrackedConnectionMixin, HTTPConnection):
+    pass
+
+class _TrackedHTTPSConnection(_TrackedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        super().connect()
+        _TRANSPORT.count("handshakes", self.host)
+
+class _TrackedHTTPPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+class _TrackedHTTPSPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTP/1.1 keep-alive：每个 host 一个连接池，大小按 HTTP_POOL_SIZES"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TrackedHTTPPool, "https": _TrackedHTTPSPool}
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pool_kwargs["maxsize"] = _TRANSPORT.pool_size(host_params["host"])
+        return host_params, pool_kwargs
+
+    def send(self, request, **kwargs):
+        r = super().send(request, **kwargs)
+        _TRANSPORT.record(r, "http/1.1")
+        return r
+
+class _Http2Headers:
+    """给 requests 的 Cookie 提取用：它只需要 get_all"""
+
+    def __init__(self, headers):
+        self._headers = headers
+
+    def get_all(self, name, default=None):
+        return self._headers.get_list(name) or default
+
+class _Http2Body:
+    """把 httpx 的流式响应包成 requests 认得的 raw：read() 返回解压后的下一块"""
+
+    def __init__(self, resp):
+        self._resp = resp
+        self._chunks = resp.iter_bytes()
+        self._original_response = type("_Msg", (), {"msg": _Http2Headers(resp.headers)})()
+
+    def read(self, *args, **kwargs) -> bytes:
+        return next(self._chunks, b"")
+
+    def close(self):
+        self._resp.close()
+
+class _Http2Adapter(BaseAdapter):
+    """
+    HTTP/2（httpx）：同一个 host 的并发请求在一条连接上多路复用。
+    响应转换成 requests.Response，http_get / Discord 的代码不用区分协议；Cookie 照常进 Session。
+    """
+
+    def __init__(self, httpx):
+        super().__init__()
+        self._httpx = httpx
+        self._clients = {}   # verify（True / CA 文件路径 / False）-> httpx.Client，httpx 只能按客户端设置证书校验
+        self._lock = threading.Lock()
+
+    def _client(self, verify):
+        with self._lock:
+            client = self._clients.get(verify)
+            if client is None:
+                ctx = verify
+                if isinstance(verify, str):   # requests 的 CA 文件/目录路径
+                    ctx = ssl.create_default_context(**({"capath": verify} if os.path.isdir(verify) else {"cafile": verify}))
+                client = self._httpx.Client(http2=True, verify=ctx, follow_redirects=False, timeout=REQUEST_TIMEOUT)
+                self._clients[verify] = client
+            return client
+
+    def _timeout(self, timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return self._httpx.Timeout(read, connect=connect)
+        return self._httpx.Timeout(timeout)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        host = _host_of(request.url)
+
+        def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.complete":
+                _TRANSPORT.count("connections", host)
+            elif event == "connection.start_tls.complete":
+                _TRANSPORT.count("handshakes", host)
+
+        client = self._client(verify)
+        req = client.build_request(
+            request.method, request.url, headers=dict(request.headers), content=request.body,
+            timeout=self._timeout(timeout), extensions={"trace": trace},
+        )
+        try:
+            resp = client.send(req, stream=True)
+        except self._httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=request) from e
+        except self._httpx.HTTPError as e:
+            raise requests.ConnectionError(e, request=request) from e
+
+        r = requests.Response()
+        r.status_code = resp.status_code
+        r.reason = resp.reason_phrase
+        r.headers = CaseInsensitiveDict(resp.headers)
+        r.encoding = get_encoding_from_headers(r.headers)
+        r.raw = _Http2Body(resp)
+        r.url = request.url
+        r.request = request
+        r.connection = self
+        extract_cookies_to_jar(r.cookies, request, r.raw)
+        _TRANSPORT.record(r, resp.http_version.lower())
+        return r
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+
+class _Transport:
+    """
+    零售商、ScraperAPI、Discord 的请求都从这里出去：
+      - 同一组连接池，keep-alive 复用连接，每个 host 的池大小可单独配置
+      - DNS 结果按 DNS_CACHE_SEC 缓存，连不上时丢掉缓存重新解析
+      - HTTP2_HOSTS 里的 host 走 HTTP/2（需要 httpx[http2]，没装就退回 HTTP/1.1）
+      - 统计请求数 / 新建连接 / TLS 握手，每批检查后报一次复用率
+    """
+
+    def __init__(self, pool_maxsize: int, pool_sizes: dict, dns_ttl: float, http2_hosts: list):
+        self.pool_maxsize = pool_maxsize
+        self.pool_sizes = pool_sizes
+        self.dns_ttl = dns_ttl
+        self._dns = {}   # (host, port) -> (过期时间, [ip, ...])
+        self._lock = threading.Lock()
+        self._totals = {"requests": 0, "connections": 0, "handshakes": 0}
+        self._reported = dict(self._totals)
+        self._http1 = _PooledAdapter(pool_connections=32, pool_maxsize=pool_maxsize)
+        self._http2 = self._http2_adapter() if http2_hosts else None
+        self._http2_hosts = http2_hosts if self._http2 is not None else []
+
+    @staticmethod
+    def _http2_adapter():
+        try:
+            import httpx
+            import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖它
+        except ImportError:
+            print("WARN: HTTP2_HOSTS 已配置但未安装 httpx[http2]，继续使用 HTTP/1.1", flush=True)
+            return None
+        return _Http2Adapter(httpx)
+
+    def session(self, headers: dict = None) -> requests.Session:
+        """新建一个 Session（各自的请求头与 Cookie），底层连接池共用"""
+        s = requests.Session()
+        if headers:
+            s.headers.update(headers)
+        s.mount("https://", self._http1)
+        s.mount("http://", self._http1)
+        for host in self._http2_hosts:
+            if host == "*":
+                s.mount("https://", self._http2)
+            else:   # 按前缀匹配：带不带端口都要挂上
+                s.mount(f"https://{host}/", self._http2)
+                s.mount(f"https://{host}:", self._http2)
+        return s
+
+    def pool_size(self, host: str) -> int:
+        return self.pool_sizes.get((host or "").lower(), self.pool_maxsize)
+
+    def resolve(self, host: str, port: int):
+        """返回缓存的 IP 列表；IP 直连或不缓存时返回 None"""
+        if self.dns_ttl <= 0 or is_ipaddress(host):
+            return None
+        key, now = (host, port), time.monotonic()
+        with self._lock:
+            hit = self._dns.get(key)
+        if hit is not None and hit[0] > now:
+            METRICS.inc("dns_lookups_total", result="hit")
+            return hit[1]
+        METRICS.inc("dns_lookups_total", result="miss")
+        infos = socket.getaddrinfo(host, port, _u3_connection.allowed_gai_family(), socket.SOCK_STREAM)
+        addrs = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._dns[key] = (now + self.dns_ttl, addrs)
+        return addrs
+
+    def forget(self, host: str, port: int):
+        with self._lock:
+            self._dns.pop((host, port), None)
+
+    def count(self, what: str, host: str):
+        """what: connections / handshakes"""
+        with self._lock:
+            self._totals[what] += 1
+        METRICS.inc("http_connections_opened_total" if what == "connections" else "http_tls_handshakes_total", host=host)
+
+    def record(self, r: requests.Response, protocol: str):
+        host = _host_of(r.request.url)
+        with self._lock:
+            self._totals["requests"] += 1
+        METRICS.inc("http_pool_requests_total", host=host, protocol=protocol)
+        METRICS.inc("http_content_encoding_total", host=host, encoding=r.headers.get("Content-Encoding") or "identity")
+
+    def cycle_report(self) -> str:
+        """距上次调用以来的请求数、新建连接、TLS 握手与连接复用率"""
+        with self._lock:
+            delta = {k: v - self._reported[k] for k, v in self._totals.items()}
+            self._reported = dict(self._totals)
+        if not delta["requests"]:
+            return "无出站请求"
+        reuse = max(0.0, 1 - delta["connections"] / delta["requests"])
+        return f"请求 {delta['requests']}，新建连接 {delta['connections']}（复用率 {reuse:.0%}），TLS 握手 {delta['handshakes']}"
+
+_TRANSPORT = _Transport(
+    HTTP_POOL_MAXSIZE, _parse_pool_sizes(HTTP_POOL_SIZES), DNS_CACHE_SEC,
+    [h.strip().lower() for h in HTTP2_HOSTS.split(",") if h.strip()],
+)
+# API 调用（ScraperAPI / Discord）不带零售商的浏览器请求头与 Cookie
+_API_SESSION = _TRANSPORT.session()
+
 # ===== HTTP: Session + 预热 + Incapsula 检测 =====
-_SESSION = requests.Session()
-_SESSION.headers.update(HEADERS)
+_SESSION = _TRANSPORT.session(HEADERS)
+
+# 每个 host 一个信号量，限制同一站点的并发请求数（避免把对方打到限流）
+_HOST_SEMAPHORES = {}
+_HOST_SEMAPHORES_LOCK = threading.Lock()
 
-def _inject_cookie_for_domain(session: requests.Session, domain: str, cookie_str: str):
-    """把浏览器拷贝的整串 Cookie 按域名精准注入到 session"""
+def _host_of(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+def _host_semaphore(url: str, limit: int = None) -> threading.BoundedSemaphore:
+    """limit 为站点适配器给的并发上限（None 用 PER_HOST_CONCURRENCY），只在该 host 第一次请求时生效"""
+    host = _host_of(url)
+    with _HOST_SEMAPHORES_LOCK:
+        sem = _HOST_SEMAPHORES.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(max(1, PER_HOST_CONCURRENCY if limit is None else limit))
+            _HOST_SEMAPHORES[host] = sem
+        return sem
+
+def _inject_cookie_for_domain(session: requests.Session, domain: str, cookie_str: str, skip: set = frozenset()):
+    """把浏览器拷贝的整串 Cookie 按域名精准注入到 session；skip 里的名字不覆盖"""
     if not cookie_str.strip():
         return
     for part in cookie_str.split(";"):
@@ -61,7 +668,7 @@ def _inject_cookie_for_domain(session: requests.Session, domain: str, cookie_str
             k, v = part.split("=", 1)
             k = k.strip()
             v = v.strip()
-            if not k:
+            if not k or k in skip:
                 continue
             ck = create_cookie(name=k, value=v, domain=domain, path="/")
             session.cookies.set_cookie(ck)
@@ -71,16 +678,27 @@ def _is_incapsula_block(html: str) -> bool:
     return ("_incapsula_resource" in low) or ('name="robots"' in low and "noindex" in low)
 
 _sportsexperts_inited = False
+_WARMUP_LOCK = threading.Lock()
 def _warmup_sportsexperts():
     """预热域并注入浏览器 Cookie，尽量拿到真实页面"""
+    with _WARMUP_LOCK:
+        _warmup_sportsexperts_locked()
+
+def _warmup_sportsexperts_locked():
     global _sportsexperts_inited
     if _sportsexperts_inited:
         return
 
+    # 先恢复上次浏览器过盾拿到的 Cookie，预热请求就能直接带上
+    _COOKIE_STORE.load()
+    restored = {c["name"] for c in _COOKIE_STORE.browser_cookies() if "sportsexperts.ca" in c["domain"]}
+
     if SPORTSEXPERTS_COOKIE:
-        _inject_cookie_for_domain(_SESSION, ".sportsexperts.ca", SPORTSEXPERTS_COOKIE)
-        _inject_cookie_for_domain(_SESSION, "www.sportsexperts.ca", SPORTSEXPERTS_COOKIE)
-        _SESSION.headers["Cookie"] = SPORTSEXPERTS_COOKIE
+        # 恢复出来的 Cookie 比环境变量里手工拷贝的新：同名的不覆盖，也不设静态 Cookie 头（否则 requests 不看 cookie jar）
+        _inject_cookie_for_domain(_SESSION, ".sportsexperts.ca", SPORTSEXPERTS_COOKIE, skip=restored)
+        _inject_cookie_for_domain(_SESSION, "www.sportsexperts.ca", SPORTSEXPERTS_COOKIE, skip=restored)
+        if not restored:
+            _SESSION.headers["Cookie"] = SPORTSEXPERTS_COOKIE
         if DEBUG:
             names = [c.name for c in _SESSION.cookies if "sportsexperts.ca" in (c.domain or "")]
             print("[DEBUG] 已注入 sportsexperts Cookie 名称：", names, flush=True)
@@ -101,68 +719,433 @@ def _warmup_sportsexperts():
 
     _sportsexperts_inited = True
 
-def _debug_save_html(site: str, name: str, url: str, html: str):
-    if not DEBUG:
-        return
-    safe = re.sub(r"[^a-zA-Z0-9_-]+", "_", f"{site}_{name}")
-    ts   = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
-    path = f"/tmp/{safe}_{ts}.html"
-    try:
-        with open(path, "w", encoding="utf-8") as f:
+class _SnapshotRing:
+    """
+    DEBUG 页面快照的环形缓冲：后台线程 gzip 后写进目录，总大小超过 max_bytes 删最旧的。
+    队列满了（写盘跟不上）就丢弃这份，轮询线程从不等磁盘；在内存里排队的页面最多 queue_size 份。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, queue_size: int = 8):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._started = False
+        self._seq = 0   # 同一毫秒内的多份快照靠序号区分
+
+    def add(self, site: str, name: str, url: str, html: str):
+        with self._lock:
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._run, name="snapshots", daemon=True).start()
+        try:
+            self._queue.put_nowait((time.time(), site, name, url, html))
+        except queue.Full:
+            METRICS.inc("debug_snapshots_dropped_total")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._write(*item)
+            except Exception as e:
+                print(f"[DEBUG] 保存 HTML 快照失败: {e}", flush=True)
+            del item
+
+    def _write(self, at: float, site: str, name: str, url: str, html: str):
+        os.makedirs(self.directory, exist_ok=True)
+        safe = re.sub(r"[^a-zA-Z0-9_-]+", "_", f"{site}_{name}")
+        self._seq = (self._seq + 1) % 1000
+        ts   = dt.datetime.fromtimestamp(at).strftime("%Y%m%d-%H%M%S") + f"-{int(at * 1000) % 1000:03d}{self._seq:03d}"
+        path = os.path.join(self.directory, f"{ts}_{safe}.html.gz")
+        with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as f:
             f.write(f"<!-- {url} -->\n")
             f.write(html)
         print(f"[DEBUG] 已保存 HTML 快照: {path}", flush=True)
-    except Exception as e:
-        print(f"[DEBUG] 保存 HTML 快照失败: {e}", flush=True)
+        self._trim()
+
+    def _trim(self):
+        # 文件名以时间开头，按名字排序即按时间排序
+        files = sorted((e for e in os.scandir(self.directory) if e.name.endswith(".html.gz")), key=lambda e: e.name)
+        sizes = [e.stat().st_size for e in files]
+        total = sum(sizes)
+        for entry, size in zip(files, sizes):
+            if total <= self.max_bytes:
+                break
+            os.remove(entry.path)
+            total -= size
+
+_SNAPSHOTS = _SnapshotRing(os.path.join(STATE_DIR, "snapshots"), int(DEBUG_SNAPSHOT_MAX_MB * 1024 * 1024))
+
+def _debug_save_html(site: str, name: str, url: str, html: str):
+    """DEBUG 时把页面交给快照环形缓冲（异步压缩落盘，总量有上限）"""
+    if not DEBUG:
+        return
+    _SNAPSHOTS.add(site, name, url, html)
+
+# ===== 浏览器 Cookie 回灌 =====
+class _CookieStore:
+    """
+    Playwright 过了 Incapsula 之后拿到的 Cookie：
+      - 回灌进 _SESSION，后续请求走普通 HTTP 即可
+      - 带过期时间落盘（会话 Cookie 按 COOKIE_SESSION_TTL_SEC 估算），重启后继续用
+      - 新建浏览器 context 时也注入，减少再次挑战
+    """
+
+    def __init__(self, path: str, session_ttl: int):
+        self.path = path
+        self.session_ttl = session_ttl
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._cookies = {}   # (domain, path, name) -> cookie dict（Playwright 格式，expires 为绝对时间戳）
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    saved = json.load(f)
+            except FileNotFoundError:
+                return
+            except Exception as e:
+                print(f"读取 Cookie 缓存失败: {e}", flush=True)
+                return
+            now = time.time()
+            for c in saved:
+                if c.get("expires", 0) > now:
+                    self._cookies[(c["domain"], c["path"], c["name"])] = c
+                    self._apply(c)
+            if DEBUG: print(f"[DEBUG] 已恢复浏览器 Cookie {len(self._cookies)} 个", flush=True)
+
+    def absorb(self, cookies: list):
+        """收下浏览器 context 的 Cookie（context.cookies() 的返回值）"""
+        if not cookies:
+            return
+        now = time.time()
+        with self._lock:
+            self._loaded = True
+            for c in cookies:
+                expires = c.get("expires") or -1
+                c = {
+                    "name": c["name"], "value": c["value"],
+                    "domain": c.get("domain") or "", "path": c.get("path") or "/",
+                    "expires": expires if expires > 0 else now + self.session_ttl,
+                    "secure": bool(c.get("secure")), "httpOnly": bool(c.get("httpOnly")),
+                }
+                self._cookies[(c["domain"], c["path"], c["name"])] = c
+                self._apply(c)
+            # 静态 Cookie 头会让 requests 忽略 cookie jar，已有浏览器 Cookie 后不再需要它
+            _SESSION.headers.pop("Cookie", None)
+            self._save(now)
+        if DEBUG: print(f"[DEBUG] 已回灌浏览器 Cookie {len(cookies)} 个", flush=True)
+
+    def browser_cookies(self) -> list:
+        now = time.time()
+        with self._lock:
+            return [dict(c) for c in self._cookies.values() if c["expires"] > now]
+
+    def _apply(self, c: dict):
+        ck = create_cookie(
+            name=c["name"], value=c["value"], domain=c["domain"], path=c["path"],
+            expires=int(c["expires"]), secure=c["secure"],
+            rest={"HttpOnly": None} if c["httpOnly"] else {},
+        )
+        _SESSION.cookies.set_cookie(ck)
+
+    def _save(self, now: float):
+        alive = [c for c in self._cookies.values() if c["expires"] > now]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(alive, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"保存 Cookie 缓存失败: {e}", flush=True)
+
+_COOKIE_STORE = _CookieStore(os.path.join(STATE_DIR, "browser_cookies.json"), COOKIE_SESSION_TTL_SEC)
 
 # ====== Playwright 兜底（真浏览器渲染）======
-def _http_get_via_playwright(url: str) -> str:
+def _playwright_cookies() -> list:
+    """把 SPORTSEXPERTS_COOKIE 转成 context.add_cookies 需要的格式"""
+    cookies = []
+    for part in SPORTSEXPERTS_COOKIE.split(";"):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            k = k.strip(); v = v.strip()
+            if not k: continue
+            cookies.append({"name": k, "value": v, "domain": "www.sportsexperts.ca", "path": "/"})
+            cookies.append({"name": k, "value": v, "domain": ".sportsexperts.ca", "path": "/"})
+    return cookies
+
+def _process_rss_mb():
+    """本进程 RSS（MB）：优先读 /proc/self/statm，其次 psutil；都不可用返回 None"""
     try:
-        from playwright.sync_api import sync_playwright
-    except Exception as e:
-        if DEBUG: print(f"[DEBUG] Playwright 未安装或导入失败: {e}", flush=True)
-        return ""
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        pass
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=PLAYWRIGHT_HEADLESS)
-            context = browser.new_context(
-                user_agent=HEADERS["User-Agent"],
-                locale="en-CA",
-                timezone_id="America/Toronto",
-            )
-            # 注入 cookie（可选）
-            if SPORTSEXPERTS_COOKIE:
-                cookies = []
-                for part in SPORTSEXPERTS_COOKIE.split(";"):
-                    if "=" in part:
-                        k, v = part.split("=", 1)
-                        k = k.strip(); v = v.strip()
-                        if not k: continue
-                        cookies.append({"name": k, "value": v, "domain": "www.sportsexperts.ca", "path": "/"})
-                        cookies.append({"name": k, "value": v, "domain": ".sportsexperts.ca", "path": "/"})
-                if cookies:
-                    context.add_cookies(cookies)
-
-            page = context.new_page()
-            page.goto(url, wait_until="networkidle", timeout=PLAYWRIGHT_TIMEOUT_MS)
-
-            # 可选：处理隐私弹窗之类（不阻塞失败）
-            for text in ["Accept", "I agree", "Got it", "OK"]:
-                try:
-                    page.get_by_role("button", name=text).first.click(timeout=1500)
-                    break
-                except Exception:
-                    pass
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+def _proc_descendants_rss_mb():
+    """从 /proc 找出本进程的全部后代（按 ppid 建树），累加各自 statm 的 RSS；没有 /proc 返回 None"""
+    children = defaultdict(list)
+    try:
+        pids = [int(d) for d in os.listdir("/proc") if d.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])   # comm 里可能有空格和括号，从最后一个 ) 之后数
+        except (OSError, ValueError, IndexError):
+            continue
+        children[ppid].append(pid)
+    total, stack, page = 0, list(children.get(os.getpid(), ())), os.sysconf("SC_PAGE_SIZE")
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, ()))
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                total += int(f.read().split()[1]) * page
+        except (OSError, ValueError, IndexError):
+            pass   # 已经退出
+    return total / (1024 * 1024)
+
+def _browser_rss_mb():
+    """本进程所有子进程（Playwright driver + Chromium）的 RSS 总和：优先读 /proc，其次 psutil；都不可用返回 None"""
+    rss = _proc_descendants_rss_mb()
+    if rss is not None:
+        return rss
+    try:
+        import psutil
+    except Exception:
+        return None
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except Exception:
+            pass
+    return total / (1024 * 1024)
+
+# 精简渲染拦截的资源类型与追踪域名（按后缀匹配）
+_LEAN_BLOCKED_TYPES = {"image", "media", "font", "stylesheet", "texttrack", "manifest"}
+_LEAN_BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googleadservices.com",
+    "facebook.net", "facebook.com", "hotjar.com", "clarity.ms", "bat.bing.com", "criteo.com",
+    "criteo.net", "tiktok.com", "pinterest.com", "snapchat.com", "quantserve.com", "scorecardresearch.com",
+    "newrelic.com", "nr-data.net", "bazaarvoice.com", "youtube.com", "ytimg.com", "vimeo.com",
+)
+# 任一节点出现即认为库存信号已渲染：JSON-LD / microdata / 加购按钮 / Trailhead 下拉框
+_READY_SELECTOR = ", ".join([
+    'script[type="application/ld+json"]',
+    '[itemprop="availability"]',
+    '[data-qa*="add-to-cart" i]',
+    '[data-oc-click*="addlineitem" i]',
+    "select#prodattr2",
+])
+
+async def _lean_route(route):
+    req = route.request
+    host = _host_of(req.url)
+    if req.resource_type in _LEAN_BLOCKED_TYPES or \
+       any(host == h or host.endswith("." + h) for h in _LEAN_BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+class _BrowserPool:
+    """
+    常驻 Chromium + 若干预热好的 context/page：
+      - 所有 Playwright 调用都在专属事件循环线程里执行（async API），检查线程只提交任务等结果
+      - context 用满 PLAYWRIGHT_CONTEXT_MAX_USES 次、渲染出错或内存超限时关闭重建
+      - 每次渲染前做健康检查，浏览器崩溃/断开则整体重启
+    """
+
+    def __init__(self, size: int, max_uses: int, max_rss_mb: int):
+        self.size       = max(1, size)
+        self.max_uses   = max(1, max_uses)
+        self.max_rss_mb = max_rss_mb
+        self.available  = True          # Playwright 未安装时置 False，之后直接跳过
+        self._start_lock = threading.Lock()
+        self._loop    = None
+        self._pw      = None
+        self._browser = None
+        self._gen     = 0               # 每次（重新）启动浏览器 +1，旧 slot 归还时直接丢弃
+        self._slots   = None            # asyncio.Queue，只在事件循环线程里访问
+        self._launch_lock = None
+
+    def render(self, url: str) -> str:
+        if not self.available:
+            return ""
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="playwright", daemon=True).start()
+        fut = asyncio.run_coroutine_threadsafe(self._render(url), self._loop)
+        try:
+            return fut.result(timeout=PLAYWRIGHT_TIMEOUT_MS / 1000 * 2 + 30)
+        except Exception as e:
+            fut.cancel()
+            if DEBUG: print(f"[DEBUG] Playwright 渲染失败: {e}", flush=True)
+            return ""
 
-            # 等一小会儿，确保动态块渲染
-            page.wait_for_timeout(PLAYWRIGHT_EXTRA_WAIT_MS)
+    def close(self):
+        if self._loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=15)
+        except Exception:
+            pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
 
-            html = page.content()
-            context.close(); browser.close()
+    async def _render(self, url: str) -> str:
+        if not await self._ensure_browser():
+            return ""
+        slot = await self._slots.get()
+        ok = False
+        try:
+            html = await self._navigate(slot["page"], url)
+            ok = True
+            if html and not _is_incapsula_block(html):
+                # 过盾成功：把这个 URL 上的 Cookie 交给 requests，下次直接走普通 HTTP
+                _COOKIE_STORE.absorb(await slot["context"].cookies([url]))
             return html
-    except Exception as e:
-        if DEBUG: print(f"[DEBUG] Playwright 渲染失败: {e}", flush=True)
-        return ""
+        finally:
+            slot["uses"] += 1
+            await self._release(slot, ok)
+
+    async def _navigate(self, page, url: str) -> str:
+        if PLAYWRIGHT_LEAN:
+            return await self._navigate_lean(page, url)
+
+        await page.goto(url, wait_until="networkidle", timeout=PLAYWRIGHT_TIMEOUT_MS)
+
+        # 可选：处理隐私弹窗之类（不阻塞失败）；页面复用后弹窗通常已关闭，先数一下再点
+        for text in ["Accept", "I agree", "Got it", "OK"]:
+            try:
+                btn = page.get_by_role("button", name=text)
+                if await btn.count():
+                    await btn.first.click(timeout=1500)
+                    break
+            except Exception:
+                pass
+
+        # 等一小会儿，确保动态块渲染
+        await page.wait_for_timeout(PLAYWRIGHT_EXTRA_WAIT_MS)
+        return await page.content()
+
+    async def _navigate_lean(self, page, url: str) -> str:
+        """DOM 就绪后只等库存信号节点（可跨 Incapsula 挑战后的跳转）；超时就拿当前 DOM 交给解析兜底"""
+        await page.goto(url, wait_until="domcontentloaded", timeout=PLAYWRIGHT_TIMEOUT_MS)
+        try:
+            await page.wait_for_selector(_READY_SELECTOR, state="attached", timeout=PLAYWRIGHT_READY_TIMEOUT_MS)
+        except Exception as e:
+            if DEBUG: print(f"[DEBUG] 精简渲染未等到库存信号节点: {e}", flush=True)
+        return await page.content()
+
+    async def _ensure_browser(self) -> bool:
+        """健康检查：浏览器不存在或已断开时（重新）启动，并补齐 context 池"""
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+            self._slots = asyncio.Queue()
+        async with self._launch_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return True
+            try:
+                from playwright.async_api import async_playwright
+            except Exception as e:
+                if DEBUG: print(f"[DEBUG] Playwright 未安装或导入失败: {e}", flush=True)
+                self.available = False
+                return False
+            if self._browser is not None:
+                # 断开可能是浏览器崩了，也可能是 Playwright 驱动进程没了：驱动一起重启，否则之后每次 launch 都失败
+                print("[playwright] 浏览器已断开，重新启动", flush=True)
+                await self._shutdown()
+            try:
+                self._pw = await async_playwright().start()
+                self._browser = await self._pw.chromium.launch(headless=PLAYWRIGHT_HEADLESS)
+                self._gen += 1
+                while not self._slots.empty():
+                    self._slots.get_nowait()
+                for _ in range(self.size):
+                    self._slots.put_nowait(await self._new_slot())
+                return True
+            except Exception as e:
+                if DEBUG: print(f"[DEBUG] Playwright 启动失败: {e}", flush=True)
+                # 启动到一半失败（如补 context 时出错）：已经起来的浏览器和驱动都关掉，不留孤儿 Chromium
+                await self._shutdown()
+                return False
+
+    async def _new_slot(self) -> dict:
+        context = await self._browser.new_context(
+            user_agent=HEADERS["User-Agent"],
+            locale="en-CA",
+            timezone_id="America/Toronto",
+        )
+        # 注入 cookie（可选）
+        cookies = _playwright_cookies() if SPORTSEXPERTS_COOKIE else []
+        cookies += _COOKIE_STORE.browser_cookies()
+        if cookies:
+            await context.add_cookies(cookies)
+        if PLAYWRIGHT_LEAN:
+            await context.route("**/*", _lean_route)
+        page = await context.new_page()
+        return {"context": context, "page": page, "uses": 0, "gen": self._gen}
+
+    def _over_memory(self) -> bool:
+        if self.max_rss_mb <= 0:
+            return False
+        rss = _browser_rss_mb()
+        return rss is not None and rss > self.max_rss_mb
+
+    async def _release(self, slot: dict, ok: bool):
+        if slot["gen"] != self._gen:
+            return  # 属于已重启前的浏览器，重启时池子已补齐
+        if ok and slot["uses"] < self.max_uses and not self._over_memory():
+            self._slots.put_nowait(slot)
+            return
+        if DEBUG: print(f"[DEBUG] 回收 Playwright context（已用 {slot['uses']} 次，ok={ok}）", flush=True)
+        try:
+            await slot["context"].close()
+        except Exception:
+            pass
+        try:
+            self._slots.put_nowait(await self._new_slot())
+        except Exception as e:
+            # 建不出新 context 基本说明浏览器已坏：关掉它，下一次健康检查整体重启并补齐
+            if DEBUG: print(f"[DEBUG] 重建 Playwright context 失败: {e}", flush=True)
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+
+    async def _shutdown(self):
+        """关闭浏览器并停掉驱动；任何一步出错都继续往下关，最后两者都置空"""
+        browser, pw = self._browser, self._pw
+        self._browser = self._pw = None
+        self._gen += 1   # 借出去的 slot 归还时直接丢弃
+        for close in (browser.close if browser else None, pw.stop if pw else None):
+            if close is None:
+                continue
+            try:
+                await close()
+            except Exception:
+                pass
+
+_BROWSER_POOL = _BrowserPool(PLAYWRIGHT_POOL_SIZE, PLAYWRIGHT_CONTEXT_MAX_USES, PLAYWRIGHT_MAX_RSS_MB)
+atexit.register(_BROWSER_POOL.close)
+
+def _http_get_via_playwright(url: str) -> str:
+    html = _BROWSER_POOL.render(url)
+    return html[:MAX_BODY_BYTES] if html else html
 
 # ===== 可选：ScraperAPI 兜底（备用，留着不影响运行）=====
 def _http_get_via_scraperapi(url: str) -> str:
@@ -171,135 +1154,648 @@ def _http_get_via_scraperapi(url: str) -> str:
     try:
         api = "http://api.scraperapi.com"
         params = {"api_key": SCRAPERAPI_KEY, "render": "true", "country_code": "ca", "url": url}
-        r = requests.get(api, params=params, timeout=REQUEST_TIMEOUT)
+        r = _API_SESSION.get(api, params=params, timeout=REQUEST_TIMEOUT)
         r.raise_for_status()
         return r.text
     except Exception as e:
         if DEBUG: print(f"[DEBUG] ScraperAPI 调用失败: {e}", flush=True)
         return ""
 
-def http_get(url: str) -> str:
-    if "sportsexperts.ca" in url:
-        _warmup_sportsexperts()
-    delay = 0.4
-    last_err = None
-    for attempt in range(5):
-        try:
-            r = _SESSION.get(url, timeout=REQUEST_TIMEOUT, allow_redirects=True)
-            r.raise_for_status()
-            text = r.text
-
-            if DEBUG and "sportsexperts.ca" in url:
-                _debug_save_html("sportsexperts", "page", url, text)
-                print("[sportsexperts][DEBUG] 页面长度:", len(text), flush=True)
-
-            # 命中 Incapsula：优先用 Playwright 真浏览器兜底；失败再试 ScraperAPI（若配置）
-            if "sportsexperts.ca" in url and _is_incapsula_block(text):
-                print("[sportsexperts] 命中 Incapsula 拦截页", flush=True)
-                alt = _http_get_via_playwright(url)
-                if alt:
-                    if DEBUG: print("[sportsexperts][DEBUG] Playwright 渲染长度:", len(alt), flush=True)
-                    return alt
-                alt2 = _http_get_via_scraperapi(url)
-                if alt2:
-                    if DEBUG: print("[sportsexperts][DEBUG] 代理渲染长度:", len(alt2), flush=True)
-                    return alt2
-
-            return text
-        except Exception as e:
-            last_err = e
-            time.sleep(min(5.0, delay))
-            delay *= 1.8
-    if last_err:
-        raise last_err
+# 每个 URL 上次 200 响应的 ETag / Last-Modified
+_VALIDATORS = {}
+_VALIDATORS_LOCK = threading.Lock()
 
-# ===== Discord 发送 =====
-def send_discord_message(text: str):
-    if not WEBHOOK_URL:
-        print("WARN: 未设置 DISCORD_WEBHOOK_URL，跳过发送", flush=True)
-        return
-    while text:
-        chunk = text[:1900]
-        text = text[1900:]
-        try:
-            r = requests.post(WEBHOOK_URL, json={"content": chunk}, timeout=15)
-            if r.status_code not in (200, 204):
-                print("Discord 发送失败:", r.status_code, r.text, flush=True)
-        except Exception as e:
-            print("Discord 请求异常:", e, flush=True)
+def _conditional_headers(url: str) -> dict:
+    with _VALIDATORS_LOCK:
+        etag, last_modified = _VALIDATORS.get(url, (None, None))
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
 
-# ===== Trailhead 库存检测 =====
-def check_stock_trailhead(url: str, color: str, sizes: list):
-    html = http_get(url)
-    soup = BeautifulSoup(html, "html.parser")
+def _remember_validators(url: str, r: requests.Response):
+    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    with _VALIDATORS_LOCK:
+        if etag or last_modified:
+            _VALIDATORS[url] = (etag, last_modified)
+        else:
+            _VALIDATORS.pop(url, None)
 
-    select = soup.find("select", id="prodattr2")
-    if not select:
-        if DEBUG: print("[trailhead] 未找到 #prodattr2，视为不可选", flush=True)
-        return {"__any__": False} if not sizes else {s: False for s in sizes}
+# ===== 按 host 熔断 =====
+class HostUnavailableError(requests.RequestException):
+    """host 熔断中（或刚被限流）：这轮不请求，retry_at 之后再试；对应商品状态记为未知而不是无货"""
 
-    options = select.find_all("option")
+    def __init__(self, host: str, retry_at: float, reason: str = ""):
+        super().__init__(f"{host} 暂停请求至 {dt.datetime.fromtimestamp(retry_at):%H:%M:%S}" + (f"（{reason}）" if reason else ""))
+        self.host = host
+        self.retry_at = retry_at
 
-    if not sizes:  # 无尺码，仅看颜色是否存在且未禁用
-        available = any(
-            (opt.get("data-color", "").strip() == color) and (not opt.has_attr("disabled"))
-            for opt in options
-        )
-        if DEBUG: print(f"[trailhead] {color} -> {'有货' if available else '无货'} (无尺码)", flush=True)
-        return {"__any__": available}
+def _parse_retry_after(value):
+    """Retry-After 可能是秒数或 HTTP 日期；返回秒数（不超过 RETRY_AFTER_MAX_SEC），无法解析返回 None"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except Exception:
+            return None
+    return max(0.0, min(float(RETRY_AFTER_MAX_SEC), seconds))
 
-    # 有尺码
-    stock_status = {size: False for size in sizes}
-    for opt in options:
-        if opt.get("data-color", "").strip() == color:
-            opt_size = opt.get("data-size", "").strip()
-            if opt_size in stock_status:
-                stock_status[opt_size] = not opt.has_attr("disabled")
-    if DEBUG: print(f"[trailhead] {color} 尺码状态: {stock_status}", flush=True)
-    return stock_status
+class _CircuitBreaker:
+    """
+    每个 host 一个断路器：
+      closed    正常请求；连续失败 threshold 次（或 429/503）后转 open
+      open      cooldown（或 Retry-After）内一律不请求
+      half-open 冷却结束后只放一个探测请求，成功则恢复，失败则再次 open
+    """
 
-# ===== 辅助：Sports Experts 解析 =====
-_AVAIL_NEG_PATTERNS = [
-    "sold out", "out of stock", "currently unavailable",
-    "in-store only", "in store only", "see store availability",  # 门店专售：线上视为无货
-    "rupture de stock", "épuisé", "indisponible"  # 法语兜底
-]
-_BTN_TEXT_PATTERNS = [
-    "add to cart", "ajouter au panier",
-    "add to bag", "add to basket"
-]
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._hosts = {}   # host -> {"failures", "open_until", "probing"}
 
-def _text_has_any(hay: str, needles: list) -> bool:
-    hay = (hay or "").lower()
-    return any(n in hay for n in needles)
+    def before_request(self, host: str):
+        now = time.time()
+        with self._lock:
+            st = self._hosts.get(host)
+            if st is None or not st["open_until"]:
+                return
+            if now < st["open_until"]:
+                raise HostUnavailableError(host, st["open_until"], "熔断中")
+            if st["probing"]:
+                raise HostUnavailableError(host, now + REQUEST_TIMEOUT, "等待探测请求结果")
+            st["probing"] = True
 
-def _is_element_enabled(el: element.Tag) -> bool:
-    if "disabled" in el.attrs: return False
-    if (el.get("aria-disabled") or "").lower() in ("true", "1"): return False
-    if (el.get("aria-hidden") or "").lower() in ("true", "1"): return False
-    if el.has_attr("hidden"): return False
-    if (el.get("data-available") or "").lower() in ("false", "0"): return False
-    self_tokens = {c.lower() for c in (el.get("class") or []) if isinstance(c, str)}
-    if self_tokens & {"disabled", "is-disabled", "disabled-button", "soldout", "is-hidden", "sr-only"}:
-        return False
-    style = (el.get("style") or "").replace(" ", "").lower()
-    if any(s in style for s in ["display:none", "visibility:hidden", "pointer-events:none", "opacity:0"]):
-        return False
-    parent = el.parent
-    depth = 0
-    while parent is not None and depth < 4:
-        if isinstance(parent, element.Tag):
-            if (parent.get("aria-hidden") or "").lower() in ("true", "1"): return False
-            if parent.has_attr("hidden"): return False
-            pstyle = (parent.get("style") or "").replace(" ", "").lower()
-            if any(s in pstyle for s in ["display:none", "visibility:hidden"]):
-                return False
-            ptokens = {c.lower() for c in (parent.get("class") or []) if isinstance(c, str)}
-            if ptokens & {"d-none", "hidden", "visually-hidden", "sr-only", "is-hidden"}:
-                return False
-        parent = parent.parent
-        depth += 1
-    return True
+    def success(self, host: str):
+        with self._lock:
+            if self._hosts.pop(host, None) is not None:
+                print(f"[{host}] 恢复正常，解除熔断", flush=True)
+
+    def failure(self, host: str, retry_after: float = None):
+        """记一次失败；若因此熔断，返回恢复时间戳，否则返回 None"""
+        now = time.time()
+        with self._lock:
+            st = self._hosts.setdefault(host, {"failures": 0, "open_until": 0.0, "probing": False})
+            st["failures"] += 1
+            st["probing"] = False
+            if retry_after is None and st["failures"] < self.threshold:
+                return None
+            st["open_until"] = now + (self.cooldown if retry_after is None else retry_after)
+        print(f"[{host}] 熔断 {st['open_until'] - now:.0f}s（连续失败 {st['failures']} 次）", flush=True)
+        return st["open_until"]
+
+    def open_until(self, host: str) -> float:
+        with self._lock:
+            st = self._hosts.get(host)
+            return st["open_until"] if st else 0.0
+
+_BREAKER = _CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN_SEC)
+
+# ===== 流式读取：库存信号到手就断开 =====
+class _StreamWatcher:
+    """
+    边下载边看：在新到的文本里找 start，再找它之后的 end；一段齐了交给
+    confirm(片段内容, 取截至片段末尾全文的函数) 确认，返回 True 表示剩下的内容不会改变判定，可以断开。
+    只保留还没看完的尾部，整页文本不会被反复拼接或扫描。
+    """
+
+    OVERLAP = 512   # 标签可能被 chunk 切断，每次往回多看一点
+
+    def __init__(self, start_re: re.Pattern, end_re: re.Pattern, confirm):
+        self.start_re = start_re
+        self.end_re = end_re
+        self.confirm = confirm
+        self._buf = ""      # 没看完的尾部；找到 start 后从 start 开始保留
+        self._scan = 0      # _buf 里从哪里接着找
+        self._head = None   # 找到 start 时为开始标签的长度
+
+    def feed(self, piece: str, full) -> bool:
+        buf, scan = self._buf + piece, self._scan
+        while True:
+            if self._head is None:
+                m = self.start_re.search(buf, scan)
+                if m is None:
+                    self._buf, self._scan = buf[max(0, len(buf) - self.OVERLAP):], 0
+                    return False
+                buf = buf[m.start():]
+                self._head = scan = m.end() - m.start()
+            e = self.end_re.search(buf, max(self._head, scan))
+            if e is None:
+                self._buf, self._scan = buf, max(self._head, len(buf) - self.OVERLAP)
+                return False
+            raw, rest = buf[self._head:e.start()], len(buf) - e.end()
+            self._head = None
+            buf, scan = buf[e.end():], 0
+
+            def head(rest=rest):
+                text = full()
+                return text[:len(text) - rest]
+            if self.confirm(raw, head):
+                return True
+
+def _drain_for_reuse(r: requests.Response) -> bool:
+    """
+    提前结束时决定连接的去留：没读完的响应直接 close，urllib3 只能丢掉这条 socket，下次要重新 TCP + TLS 握手。
+    握手大约是 2 个往返外加一次非对称加密；读完几百 KB 的剩余部分通常更便宜，
+    所以剩余不超过 STREAM_DRAIN_MAX_BYTES 时读完丢弃（不解压），连接照常复用；剩余很大时才断开省流量。
+    Content-Length 已知且剩余过大就直接放弃；chunked 响应边读边数，超过上限同样放弃。返回连接是否保住了。
+    """
+    raw = r.raw
+    try:
+        length = int(r.headers.get("Content-Length") or -1)
+        if length >= 0 and hasattr(raw, "tell") and length - raw.tell() > STREAM_DRAIN_MAX_BYTES:
+            return False
+        drained = 0
+        while drained <= STREAM_DRAIN_MAX_BYTES:
+            chunk = raw.read(64 * 1024, decode_content=False)
+            if not chunk:
+                return True
+            drained += len(chunk)
+    except Exception:
+        pass
+    return False
+
+def _read_body(r: requests.Response, watcher: _StreamWatcher = None, limit: int = MAX_BODY_BYTES) -> tuple:
+    """
+    按块读取并解码，最多读 limit 字节；watcher 确认信号到手后提前结束。
+    返回 (文本, 已读字节数, 提前结束的原因："" / "signal" / "limit")。
+    读完后连接回到连接池；提前结束时剩余部分不大就读完丢弃，同样回池（见 _drain_for_reuse）。
+    """
+    decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")(errors="replace")
+    parts, nbytes = [], 0
+    full = lambda: "".join(parts)
+    try:
+        for chunk in r.iter_content(chunk_size=max(1024, STREAM_CHUNK_BYTES)):
+            nbytes += len(chunk)
+            piece = decoder.decode(chunk)
+            parts.append(piece)
+            if watcher is not None and watcher.feed(piece, full):
+                _drain_for_reuse(r)
+                return full(), nbytes, "signal"
+            if nbytes >= limit:
+                _drain_for_reuse(r)
+                return full(), nbytes, "limit"
+        parts.append(decoder.decode(b"", final=True))
+        return full(), nbytes, ""
+    finally:
+        r.close()
+
+def http_get(url: str, conditional: bool = False, adapter: "SiteAdapter" = None, headers: dict = None):
+    """
+    抓取页面（含重试、熔断与站点兜底）。
+    adapter 为空时按域名找站点适配器，由它负责预热、识别拦截页与兜底渲染；headers 为额外请求头。
+    conditional=True 时带上次的 ETag / Last-Modified，服务器回 304 则返回 None。
+    host 熔断中或回 429/503 时抛 HostUnavailableError，由调度器按 retry_at 重新排期，不在这里 sleep 等待。
+    """
+    host = _host_of(url)
+    _BREAKER.before_request(host)
+    adapter = adapter or adapter_for_url(url)
+    if adapter is not None:
+        adapter.warmup()
+    validators = _conditional_headers(url) if conditional else {}
+    headers = {**(headers or {}), **validators} or None
+    limit = adapter.concurrency if adapter is not None else None
+    stream = STREAM_FETCH and adapter is not None
+    delay = 0.4
+    last_err = None
+    for attempt in range(max(1, HTTP_ATTEMPTS)):
+        if attempt:
+            METRICS.inc("http_retries_total", host=host)
+            time.sleep(delay)
+            delay *= 1.8
+        try:
+            # 只在真正发请求时占用 host 名额；退避 sleep 在 with 之外，不阻塞同站点其他商品
+            with _host_semaphore(url, limit), METRICS.span("fetch", host=host):
+                # 总是流式读取：响应体有上限，200 的页面还可以在信号到手后提前断开
+                r = _SESSION.get(url, headers=headers, timeout=REQUEST_TIMEOUT, allow_redirects=True, stream=True)
+                if r.status_code == 200:
+                    text, nbytes, stopped = _read_body(r, adapter.stream_watcher() if stream else None)
+                else:
+                    text, nbytes, stopped = _read_body(r, limit=64 * 1024)
+        except Exception as e:
+            METRICS.inc("http_requests_total", host=host, status="error")
+            last_err = e
+            continue
+        METRICS.inc("http_requests_total", host=host, status=str(r.status_code))
+        METRICS.inc("http_bytes_total", nbytes, host=host)
+        if stopped == "signal":
+            METRICS.inc("stream_stops_total", site=adapter.name)
+            if DEBUG: print(f"[{adapter.name}][DEBUG] 库存信号已到手，只读了 {nbytes} 字节: {url}", flush=True)
+        elif stopped == "limit":
+            METRICS.inc("body_truncated_total", host=host)
+            print(f"[{host}] 响应体超过 {MAX_BODY_BYTES} 字节，只取前面部分: {url}", flush=True)
+
+        if r.status_code in (429, 503):
+            # 被限流/维护：立刻熔断，按 Retry-After（没有就按默认冷却）交给调度器
+            retry_at = _BREAKER.failure(host, _parse_retry_after(r.headers.get("Retry-After")) or BREAKER_COOLDOWN_SEC)
+            raise HostUnavailableError(host, retry_at, f"HTTP {r.status_code}")
+        if r.status_code >= 500:
+            last_err = requests.HTTPError(f"{r.status_code} Server Error for url: {r.url}", response=r)
+            continue
+        # 能正常应答（包括 4xx 这种页面本身的问题）就说明 host 是健康的
+        _BREAKER.success(host)
+        if validators and r.status_code == 304:
+            if DEBUG: print(f"[DEBUG] 304 未修改: {url}", flush=True)
+            METRICS.inc("page_cache_hits_total", reason="304")
+            return None
+        r.raise_for_status()
+
+        if adapter is not None:
+            if DEBUG:
+                _debug_save_html(adapter.name, "page", url, text)
+                print(f"[{adapter.name}][DEBUG] 页面长度:", len(text), flush=True)
+            # 命中拦截页：交给站点适配器兜底（如 Playwright -> ScraperAPI），兜底结果不记 ETag
+            if adapter.is_blocked(text):
+                METRICS.inc("block_page_hits_total", host=host)
+                return adapter.rescue(url, text)
+
+        _remember_validators(url, r)
+        return text
+
+    retry_at = _BREAKER.failure(host)
+    if retry_at is not None:
+        raise HostUnavailableError(host, retry_at, str(last_err)) from last_err
+    raise last_err
+
+# ===== 库存片段指纹：页面没变就不再解析 =====
+_TRAILHEAD_SELECT_RE = re.compile(r"<select\b[^>]*\sid=[\"']?prodattr2[\"'\s/>].*?</select>", re.S | re.I)
+_JSONLD_RE = re.compile(r"<script\b[^>]*application/ld\+json[^>]*>.*?</script>", re.S | re.I)
+# 流式读取用：只认开始标签。JSON-LD 的 type 与单遍提取一样按原值精确匹配
+_TRAILHEAD_SELECT_START_RE = re.compile(r"<select\b[^>]*\sid=[\"']?prodattr2[\"'\s/>]", re.I)
+_SELECT_END_RE = re.compile(r"</select\s*>", re.I)
+_JSONLD_START_RE = re.compile(r"(?i:<script)\b[^>]*\s(?i:type)\s*=\s*([\"']?)application/ld\+json\1[\s/>]")
+_SCRIPT_END_RE = re.compile(r"</script\s*>", re.I)
+# Sports Experts 判定会用到的信号：附近一段源码参与指纹（按钮状态/父级隐藏/尺码）；
+# 加购按钮文案与无货文案（_BTN_TEXT_PATTERNS / _AVAIL_NEG_PATTERNS）也一并作为标记
+_SE_FINGERPRINT_MARKERS = (
+    "itemprop=\"availability\"", "add-to-cart", "addlineitem", "data-size", "data-variant",
+    "\"availability\"", "\"instock\"", "\"available\"", "\"inventory\"",
+)
+# 文字恰好是尺码的元素（_any_size_enabled 认的尺码按钮）：它的开始标签和父级在前面的窗口里
+_SE_SIZE_TEXT_RE = re.compile(r">\s*(?:xs|s|m|l|xl|xxl)\s*<")
+_FINGERPRINT_WINDOW = (600, 300)  # 标记前 / 后各取多少字符
+
+def _body_fingerprint(body: str) -> str:
+    """整个响应体的摘要（JSON 接口这种本身就很小、全是库存数据的响应）"""
+    return hashlib.blake2b(body.encode("utf-8", "replace"), digest_size=16).hexdigest()
+
+def _trailhead_fingerprint(html: str):
+    """取出与库存判定相关的源码片段做摘要；取不到可靠片段时返回 None（不走缓存）"""
+    m = _TRAILHEAD_SELECT_RE.search(html)
+    if not m:
+        return None
+    return _body_fingerprint(m.group(0))
+
+def _sportsexperts_fingerprint(html: str):
+    """JSON-LD、各标记与尺码按钮附近的源码做摘要；一样都没找到时返回 None（不走缓存，否则这类页面的指纹全都相同）"""
+    if _is_incapsula_block(html):
+        return None
+    h = hashlib.blake2b(digest_size=16)
+    hashed = False
+    for m in _JSONLD_RE.finditer(html):
+        h.update(m.group(0).encode("utf-8", "replace"))
+        hashed = True
+    low = html.lower()
+    before, after = _FINGERPRINT_WINDOW
+
+    def window(start: int, end: int):
+        h.update(low[max(0, start - before):end + after].encode("utf-8", "replace"))
+
+    for marker in _SE_FINGERPRINT_MARKERS + tuple(_BTN_TEXT_PATTERNS) + tuple(_AVAIL_NEG_PATTERNS):
+        start = low.find(marker)
+        while start != -1:
+            window(start, start + len(marker))
+            hashed = True
+            start = low.find(marker, start + len(marker) + after)
+    for m in _SE_SIZE_TEXT_RE.finditer(low):
+        window(m.start(), m.end())
+        hashed = True
+    return h.hexdigest() if hashed else None
+
+# (site, url) -> {"fingerprint", "result", "parsed_at"}
+_PAGE_CACHE = {}
+_PAGE_CACHE_LOCK = threading.Lock()
+
+def _forget_pages(pages):
+    """页面 (site, url) 离开关注列表后丢掉它的解析缓存与条件请求头，常驻进程里不留死条目"""
+    with _PAGE_CACHE_LOCK:
+        for page in pages:
+            _PAGE_CACHE.pop(page, None)
+    with _VALIDATORS_LOCK:
+        for site, url in pages:
+            endpoint = getattr(_ADAPTERS.get(site), "endpoint", None)   # JSON 接口按换算后的地址记
+            _VALIDATORS.pop(endpoint(url) if endpoint else url, None)
+
+# ===== Discord 发送 =====
+class _DiscordDelivery:
+    """
+    后台推送队列，轮询线程只负责入队、从不等待 webhook：
+      - 走共用传输层的连接（keep-alive，不每次重新握手）
+      - 每条通知一个 embed，每次请求最多合并 10 个
+      - 跟踪 X-RateLimit-Remaining / Reset-After，429 按 retry_after 等待后重发
+      - 网络错误/5xx 指数退避重试；待发消息落盘，重启后继续发
+    """
+
+    MAX_EMBEDS = 10
+    MAX_CHARS  = 5800     # 单次请求所有 embed 的总字数上限（Discord 为 6000）
+
+    def __init__(self, webhook: str, spool_path: str):
+        self.webhook = webhook
+        self.spool_path = spool_path
+        self._session = _API_SESSION
+        self._cond = threading.Condition()
+        self._pending = []      # [{"text", "at"}]，与 spool 文件内容一致
+        self._started = False
+        self._busy = False
+        self._not_before = 0.0  # 限流：在此之前不发请求
+
+    def enqueue(self, text: str):
+        with self._cond:
+            self._start_locked()
+            self._pending.append({"text": text, "at": time.time()})
+            METRICS.set("discord_queue_depth", len(self._pending))
+            self._save_locked()
+            self._cond.notify()
+
+    def start(self):
+        """读回上次没发完的通知并启动发送线程（进程启动时调用；重启后即使没有新通知也会补发）"""
+        with self._cond:
+            self._start_locked()
+            self._cond.notify()
+
+    def flush(self, timeout: float):
+        """等待队列发完（退出前调用），最多 timeout 秒"""
+        deadline = time.time() + timeout
+        with self._cond:
+            while (self._pending or self._busy) and time.time() < deadline:
+                self._cond.wait(timeout=min(0.5, max(0.0, deadline - time.time())))
+
+    def _start_locked(self):
+        if self._started:
+            return
+        self._started = True
+        try:
+            with open(self.spool_path, "r", encoding="utf-8") as f:
+                self._pending = json.load(f) + self._pending
+            if self._pending:
+                print(f"恢复未发送的 Discord 通知 {len(self._pending)} 条", flush=True)
+                METRICS.set("discord_queue_depth", len(self._pending))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"读取 Discord 待发队列失败: {e}", flush=True)
+        threading.Thread(target=self._run, name="discord", daemon=True).start()
+
+    def _save_locked(self):
+        tmp = f"{self.spool_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._pending, f, ensure_ascii=False)
+            os.replace(tmp, self.spool_path)
+        except Exception as e:
+            print(f"保存 Discord 待发队列失败: {e}", flush=True)
+
+    def _take_batch_locked(self) -> list:
+        batch, chars = [], 0
+        for item in self._pending[:self.MAX_EMBEDS]:
+            size = min(len(item["text"]), 4096)
+            if batch and chars + size > self.MAX_CHARS:
+                break
+            batch.append(item)
+            chars += size
+        return batch
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._busy = False
+                    self._cond.notify_all()
+                    self._cond.wait()
+                self._busy = True
+                batch = self._take_batch_locked()
+
+            wait = self._not_before - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+            result = self._post(batch)
+            if result == "retry":
+                failures += 1
+                time.sleep(min(60.0, 2 ** failures))
+                continue
+            failures = 0
+            if result == "rate_limited":
+                continue
+            with self._cond:
+                del self._pending[:len(batch)]   # 入队只会追加，发出去的一定是最前面这几条
+                METRICS.set("discord_queue_depth", len(self._pending))
+                self._save_locked()
+                self._cond.notify_all()
+
+    @staticmethod
+    def _embed(text: str) -> dict:
+        title, _, body = text.partition("\n")
+        return {
+            "title": title[:256],
+            "description": (body[:4093] + "...") if len(body) > 4096 else body,
+            "color": 0x2ECC71 if "✅" in text else 0xE74C3C,
+        }
+
+    def _post(self, batch: list) -> str:
+        """返回 ok / dropped / rate_limited / retry"""
+        result = "retry"
+        try:
+            with METRICS.span("discord_send"):
+                result = self._post_once(batch)
+        finally:
+            METRICS.inc("discord_posts_total", result=result)
+        return result
+
+    def _post_once(self, batch: list) -> str:
+        try:
+            r = self._session.post(self.webhook, json={"embeds": [self._embed(i["text"]) for i in batch]}, timeout=15)
+        except Exception as e:
+            print("Discord 请求异常:", e, flush=True)
+            return "retry"
+
+        now = time.time()
+        if r.headers.get("X-RateLimit-Remaining") == "0":
+            self._not_before = max(self._not_before, now + float(r.headers.get("X-RateLimit-Reset-After") or 1))
+        if r.status_code in (200, 204):
+            return "ok"
+        if r.status_code == 429:
+            try:
+                retry_after = float(r.json().get("retry_after"))
+            except Exception:
+                retry_after = _parse_retry_after(r.headers.get("Retry-After")) or 1.0
+            self._not_before = max(self._not_before, now + retry_after)
+            print(f"Discord 限流，{retry_after:.1f}s 后重发", flush=True)
+            return "rate_limited"
+        if r.status_code >= 500:
+            print("Discord 发送失败:", r.status_code, r.text, flush=True)
+            return "retry"
+        # 其他 4xx：内容本身有问题，重发也不会成功
+        print("Discord 发送失败（已丢弃）:", r.status_code, r.text, flush=True)
+        return "dropped"
+
+_DISCORD = _DiscordDelivery(WEBHOOK_URL, os.path.join(STATE_DIR, "discord_spool.json")) if WEBHOOK_URL else None
+if _DISCORD is not None:
+    atexit.register(_DISCORD.flush, 10)
+
+def send_discord_message(text: str):
+    """放进后台推送队列后立即返回"""
+    if _DISCORD is None:
+        print("WARN: 未设置 DISCORD_WEBHOOK_URL，跳过发送", flush=True)
+        return
+    _DISCORD.enqueue(text)
+
+# ===== Trailhead 库存检测 =====
+class _ProdattrOptionParser(HTMLParser):
+    """只认 <select id="prodattr2"> 里的 <option>，select 关闭后 done=True，后面的内容全部忽略"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.in_select = False
+        self.found = False
+        self.done = False
+        self.options = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if tag == "select":
+            if dict(attrs).get("id") == "prodattr2":
+                self.in_select = self.found = True
+        elif tag == "option" and self.in_select:
+            a = dict(attrs)
+            self.options.append({
+                "color": (a.get("data-color") or "").strip(),
+                "size": (a.get("data-size") or "").strip(),
+                "disabled": "disabled" in a,
+            })
+
+    def handle_endtag(self, tag):
+        if tag == "select" and self.in_select:
+            self.in_select = False
+            self.done = True
+
+def _parse_trailhead_options_fast(html: str):
+    """快速路径：正则切出 #prodattr2 片段，只对这一小段做词法解析；切不到或没有 option 返回 None"""
+    m = _TRAILHEAD_SELECT_RE.search(html)
+    if not m:
+        return None
+    parser = _ProdattrOptionParser()
+    parser.feed(m.group(0))
+    parser.close()
+    return parser.options if parser.found and parser.options else None
+
+def parse_trailhead_options(html: str):
+    """解析 #prodattr2 下拉框，返回 [{"color","size","disabled"}, ...]；找不到下拉框返回 None"""
+    options = _parse_trailhead_options_fast(html)
+    if options is not None:
+        return options
+
+    # 兜底：完整解析整页（快速路径没找到时，结构可能不规整）
+    soup = BeautifulSoup(html, "html.parser")
+    try:
+        select = soup.find("select", id="prodattr2")
+        if not select:
+            return None
+
+        return [
+            {
+                "color": str(opt.get("data-color", "")).strip(),
+                "size": str(opt.get("data-size", "")).strip(),
+                "disabled": opt.has_attr("disabled"),
+            }
+            for opt in select.find_all("option")
+        ]
+    finally:
+        # 整棵树是循环引用，不拆开要等 GC 才释放
+        soup.decompose()
+
+def evaluate_trailhead(options, color: str, sizes: list):
+    """根据已解析的 options 判断某个颜色（及尺码）是否有货"""
+    if options is None:
+        if DEBUG: print("[trailhead] 未找到 #prodattr2，视为不可选", flush=True)
+        return {"__any__": False} if not sizes else {s: False for s in sizes}
+
+    if not sizes:  # 无尺码，仅看颜色是否存在且未禁用
+        available = any(
+            (opt["color"] == color) and (not opt["disabled"])
+            for opt in options
+        )
+        if DEBUG: print(f"[trailhead] {color} -> {'有货' if available else '无货'} (无尺码)", flush=True)
+        return {"__any__": available}
+
+    # 有尺码
+    stock_status = {size: False for size in sizes}
+    for opt in options:
+        if opt["color"] == color:
+            opt_size = opt["size"]
+            if opt_size in stock_status:
+                stock_status[opt_size] = not opt["disabled"]
+    if DEBUG: print(f"[trailhead] {color} 尺码状态: {stock_status}", flush=True)
+    return stock_status
+
+def check_stock_trailhead(url: str, color: str, sizes: list):
+    return evaluate_trailhead(parse_trailhead_options(http_get(url, adapter=_ADAPTERS["trailhead"])), color, sizes)
+
+# ===== 辅助：Sports Experts 解析 =====
+_AVAIL_NEG_PATTERNS = [
+    "sold out", "out of stock", "currently unavailable",
+    "in-store only", "in store only", "see store availability",  # 门店专售：线上视为无货
+    "rupture de stock", "épuisé", "indisponible"  # 法语兜底
+]
+_BTN_TEXT_PATTERNS = [
+    "add to cart", "ajouter au panier",
+    "add to bag", "add to basket"
+]
+
+def _text_has_any(hay: str, needles: list) -> bool:
+    hay = (hay or "").lower()
+    return any(n in hay for n in needles)
+
+def _attrs_enabled(attrs: dict, ancestors) -> bool:
+    """元素本身及最近 4 层祖先的属性都不表示禁用/隐藏；attrs 与 bs4 一致（class 为列表）"""
+    if "disabled" in attrs: return False
+    if (attrs.get("aria-disabled") or "").lower() in ("true", "1"): return False
+    if (attrs.get("aria-hidden") or "").lower() in ("true", "1"): return False
+    if "hidden" in attrs: return False
+    if (attrs.get("data-available") or "").lower() in ("false", "0"): return False
+    self_tokens = {c.lower() for c in (attrs.get("class") or []) if isinstance(c, str)}
+    if self_tokens & {"disabled", "is-disabled", "disabled-button", "soldout", "is-hidden", "sr-only"}:
+        return False
+    style = (attrs.get("style") or "").replace(" ", "").lower()
+    if any(s in style for s in ["display:none", "visibility:hidden", "pointer-events:none", "opacity:0"]):
+        return False
+    for depth, pattrs in enumerate(ancestors):
+        if depth >= 4:
+            break
+        if (pattrs.get("aria-hidden") or "").lower() in ("true", "1"): return False
+        if "hidden" in pattrs: return False
+        pstyle = (pattrs.get("style") or "").replace(" ", "").lower()
+        if any(s in pstyle for s in ["display:none", "visibility:hidden"]):
+            return False
+        ptokens = {c.lower() for c in (pattrs.get("class") or []) if isinstance(c, str)}
+        if ptokens & {"d-none", "hidden", "visually-hidden", "sr-only", "is-hidden"}:
+            return False
+    return True
+
+def _is_element_enabled(el: element.Tag) -> bool:
+    return _attrs_enabled(el.attrs, (p.attrs for p in el.parents if isinstance(p, element.Tag)))
+
+def _atc_label_matches(label: str) -> bool:
+    return any(pat in label for pat in _BTN_TEXT_PATTERNS) or \
+           ("product-add-to-cart" in label) or ("addlineitem" in label)
 
 def _has_add_to_cart(soup: BeautifulSoup) -> bool:
     candidates = soup.select(
@@ -316,8 +1812,7 @@ def _has_add_to_cart(soup: BeautifulSoup) -> bool:
             (el.get("data-qa") or "").lower(),
             (el.get("data-oc-click") or "").lower(),
         ]))
-        if any(pat in label for pat in _BTN_TEXT_PATTERNS) or \
-           ("product-add-to-cart" in label) or ("addlineitem" in label):
+        if _atc_label_matches(label):
             if _is_element_enabled(el):
                 return True
     return False
@@ -340,9 +1835,9 @@ def _scan_avail_keys(node):
             if res is not None: return res
     return None
 
-def _parse_jsonld_availability(soup: BeautifulSoup):
-    for tag in soup.find_all("script", type="application/ld+json"):
-        raw = tag.string or tag.text or ""
+def _jsonld_availability(raws: list):
+    """依次看每段 JSON-LD 原文里的 availability：InStock -> True，OutOfStock -> False"""
+    for raw in raws:
         if not raw.strip():
             continue
         try:
@@ -367,33 +1862,58 @@ def _parse_jsonld_availability(soup: BeautifulSoup):
             if any("outofstock" in v for v in vals): return False
     return None
 
-def _parse_microdata_availability(soup: BeautifulSoup):
-    for tag in soup.select('[itemprop="availability"]'):
-        val = (tag.get("href") or tag.get("content") or tag.get_text()).lower()
+def _parse_jsonld_availability(soup: BeautifulSoup):
+    return _jsonld_availability([
+        tag.string or tag.text or "" for tag in soup.find_all("script", type="application/ld+json")
+    ])
+
+def _microdata_availability(vals: list):
+    for val in vals:
         if "instock" in val: return True
         if "outofstock" in val: return False
     return None
 
-def _parse_inline_json_availability(html: str):
-    scripts = re.findall(r"<script[^>]*>(.*?)</script>", html, flags=re.S|re.I)
+def _parse_microdata_availability(soup: BeautifulSoup):
+    return _microdata_availability([
+        (tag.get("href") or tag.get("content") or tag.get_text()).lower()
+        for tag in soup.select('[itemprop="availability"]')
+    ])
+
+_INLINE_JSON_KEYS = ('"availability"', '"inStock"', '"available"', '"inventory"')
+# 只取“从 { / [ 到第一个 } / ]”的片段，括号数不平的跳过：嵌套对象里的 available 不参与判定
+# （比如变体列表里第一个变体的 available:false 不代表整件商品无货），交给后面的加购按钮判断
+_INLINE_JSON_SNIPPET_RE = re.compile(r"(\{.*?\}|\[.*?\])", re.S)
+
+def _scan_inline_json(raw: str):
+    for m in _INLINE_JSON_SNIPPET_RE.finditer(raw):
+        snippet = m.group(1)
+        if snippet.count("{") != snippet.count("}"):
+            continue
+        try:
+            data = json.loads(snippet)
+        except ValueError:
+            continue
+        found = _scan_avail_keys(data)
+        if found is not None:
+            return found
+    return None
+
+def _inline_json_availability(scripts: list):
     for raw in scripts:
-        if not any(k in raw for k in ('"availability"', '"inStock"', '"available"', '"inventory"')):
+        if not any(k in raw for k in _INLINE_JSON_KEYS):
             continue
-        for m in re.finditer(r"(\{.*?\}|\[.*?\])", raw, flags=re.S):
-            snippet = m.group(1)
-            if snippet.count("{") != snippet.count("}"):
-                continue
-            try:
-                data = json.loads(snippet)
-            except Exception:
-                continue
-            found = _scan_avail_keys(data)
-            if found is not None:
-                return found
+        found = _scan_inline_json(raw)
+        if found is not None:
+            return found
     return None
 
+def _parse_inline_json_availability(html: str):
+    return _inline_json_availability(re.findall(r"<script[^>]*>(.*?)</script>", html, flags=re.S|re.I))
+
+_SIZE_WORDS = {"xs","s","m","l","xl","xxl"}
+
 def _any_size_enabled(soup: BeautifulSoup) -> bool:
-    size_words = {"xs","s","m","l","xl","xxl"}
+    size_words = _SIZE_WORDS
     elems = soup.select("button, a[role='button'], [data-size], [data-variant], [data-qa*='size' i]")
     for el in elems:
         if not isinstance(el, element.Tag):
@@ -403,6 +1923,181 @@ def _any_size_enabled(soup: BeautifulSoup) -> bool:
             return True
     return False
 
+# ===== 辅助：Sports Experts 单遍信号提取 =====
+# 与 bs4 html.parser 一致：自闭合标签不入栈；script/style/template 内的文字不算可见文本，
+# 这些标签自己的 get_text() 只取各自内部的文字
+_VOID_TAGS = frozenset(["area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr",
+                        "image", "img", "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid",
+                        "param", "source", "spacer", "track", "wbr"])
+_NON_TEXT_TAGS = frozenset(["script", "style", "template"])
+
+class _SportsExpertsSignals(HTMLParser):
+    """
+    单遍扫描页面、不建 DOM 树，收集全部库存信号：
+      JSON-LD / 脚本原文、[itemprop=availability]、可点的加购按钮、可选尺码、可见文本
+    候选元素的判定规则与 _has_add_to_cart / _any_size_enabled / _is_element_enabled 相同。
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.jsonld = []        # JSON-LD 脚本原文
+        self.scripts = []       # 全部脚本原文（内联 JSON 用）
+        self.microdata = []     # [itemprop=availability] 取值（文档顺序，已转小写）
+        self.add_to_cart = False
+        self.size_enabled = False
+        self.text = []          # 可见文本片段（同 get_text(strip=True)）
+        self._stack = []        # [(tag, attrs, capture)]
+        self._captures = []     # 还没闭合、需要收集文字的候选元素
+        self._containers = []   # 打开中的 script/style/template（决定文字归属）
+        self._script = None     # 当前脚本 (type, pieces)
+
+    def handle_starttag(self, tag, attrs):
+        a = {}
+        for k, v in attrs:
+            a[k] = "" if v is None else v
+        if "class" in a:
+            a["class"] = a["class"].split()
+        cap = self._candidate(tag, a)
+        if tag in _VOID_TAGS:
+            if cap is not None:
+                self._finish(cap)
+            return
+        self._stack.append((tag, a, cap))
+        if cap is not None:
+            self._captures.append(cap)
+        if tag == "script":
+            self._script = (a.get("type", ""), [])
+        if tag in _NON_TEXT_TAGS:
+            self._containers.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                self._pop_to(i)
+                return
+
+    def handle_data(self, data):
+        if self._script is not None:
+            self._script[1].append(data)
+        kind = self._containers[-1] if self._containers else None
+        piece = data.strip()
+        if kind is None and piece:
+            self.text.append(piece)
+        for cap in self._captures:
+            if cap["kind"] == kind:
+                cap["pieces"].append(data)
+
+    def finish(self):
+        self.close()
+        self._pop_to(0)
+        return self
+
+    def _pop_to(self, index: int):
+        while len(self._stack) > index:
+            tag, _, cap = self._stack.pop()
+            if tag == "script" and self._script is not None:
+                stype, pieces = self._script
+                raw = "".join(pieces)
+                self.scripts.append(raw)
+                if stype == "application/ld+json":
+                    self.jsonld.append(raw)
+                self._script = None
+            if tag in _NON_TEXT_TAGS:
+                self._containers.pop()
+            if cap is not None:
+                self._captures.remove(cap)
+                self._finish(cap)
+
+    def _candidate(self, tag: str, a: dict):
+        role_button = tag == "a" and a.get("role") == "button"
+        data_qa = a.get("data-qa", "").lower()
+        atc = tag == "button" or role_button or (tag == "input" and a.get("type", "").lower() == "submit") \
+            or "add-to-cart" in data_qa or "addlineitem" in a.get("data-oc-click", "").lower()
+        size = tag == "button" or role_button or "data-size" in a or "data-variant" in a or "size" in data_qa
+        micro = a.get("itemprop") == "availability"
+        if not (atc or size or micro):
+            return None
+        cap = {"attrs": a, "ancestors": [entry[1] for entry in reversed(self._stack[-4:])],
+               "atc": atc, "size": size, "micro": None, "pieces": [],
+               "kind": tag if tag in _NON_TEXT_TAGS else None}
+        if micro:
+            cap["micro"] = len(self.microdata)
+            self.microdata.append("")
+        return cap
+
+    def _finish(self, cap: dict):
+        a = cap["attrs"]
+        pieces = [p.strip() for p in cap["pieces"]]
+        pieces = [p for p in pieces if p]
+        if cap["micro"] is not None:
+            self.microdata[cap["micro"]] = (a.get("href") or a.get("content") or "".join(cap["pieces"])).lower()
+        if cap["atc"] and not self.add_to_cart:
+            label = " ".join(filter(None, [
+                " ".join(pieces).lower(),
+                a.get("value", "").lower(),
+                a.get("aria-label", "").lower(),
+                a.get("title", "").lower(),
+                a.get("data-qa", "").lower(),
+                a.get("data-oc-click", "").lower(),
+            ]))
+            if _atc_label_matches(label) and _attrs_enabled(a, cap["ancestors"]):
+                self.add_to_cart = True
+        if cap["size"] and not self.size_enabled:
+            txt = ("".join(pieces) or a.get("data-size") or a.get("aria-label") or "").lower()
+            if txt in _SIZE_WORDS and _attrs_enabled(a, cap["ancestors"]):
+                self.size_enabled = True
+
+# 流式下载核对 JSON-LD 时已经扫描过的前缀：(前缀文本, 提取器)。提前断开后拿到的正文以这段前缀开头，
+# 紧接着的解析从前缀末尾接着扫，不再从头扫一遍。每个线程只留最近一次，用过即清；
+# 没用上（指纹命中直接返回、解析交给了子进程）时由 check_page 结束时清掉，不让整页正文留在线程里
+_SE_PRIMED = threading.local()
+
+def _prime_sportsexperts_signals(prefix: str, p: "_SportsExpertsSignals"):
+    _SE_PRIMED.value = (prefix, p) if p is not None else None
+
+def _extract_sportsexperts_signals(html: str) -> dict:
+    """单遍提取，返回 _decide_sportsexperts 需要的信号"""
+    primed = getattr(_SE_PRIMED, "value", None)
+    _SE_PRIMED.value = None
+    p, start = _SportsExpertsSignals(), 0
+    if primed is not None and html.startswith(primed[0]):
+        p, start = primed[1], len(primed[0])
+    with METRICS.span("se_scan"):
+        p.feed(html[start:] if start else html)
+        p.finish()
+    with METRICS.span("se_structured"):
+        structured = _jsonld_availability(p.jsonld)
+        if structured is None:
+            structured = _microdata_availability(p.microdata)
+        if structured is None:
+            structured = _inline_json_availability(p.scripts)
+    return {
+        "structured": structured,
+        "add_to_cart": p.add_to_cart,
+        "size_enabled": p.size_enabled,
+        "text": " ".join(p.text),
+    }
+
+def _soup_signals(html: str) -> dict:
+    """旧的整树实现（多次遍历 BeautifulSoup），留作对照，校验单遍提取的判定一致"""
+    soup = BeautifulSoup(html, "html.parser")
+    try:
+        structured = _parse_jsonld_availability(soup)
+        if structured is None:
+            structured = _parse_microdata_availability(soup)
+        if structured is None:
+            structured = _parse_inline_json_availability(html)
+        return {
+            "structured": structured,
+            "add_to_cart": _has_add_to_cart(soup),
+            "size_enabled": _any_size_enabled(soup),
+            "text": soup.get_text(" ", strip=True),
+        }
+    finally:
+        soup.decompose()
+
 # ===== Sports Experts 库存检测 =====
 def check_stock_sportsexperts(url: str) -> bool:
     """
@@ -413,122 +2108,1393 @@ def check_stock_sportsexperts(url: str) -> bool:
       4) 页面出现 Sold out / Out of stock / In-Store Only 等字样 -> 线上无货
       5) 其他情况保守返回 False（无货）
     """
-    html = http_get(url)
-    soup = BeautifulSoup(html, "html.parser")
+    return parse_sportsexperts_availability(http_get(url, adapter=_ADAPTERS["sportsexperts"]))
+
+def parse_sportsexperts_availability(html: str) -> bool:
+    """check_stock_sportsexperts 的解析部分：单遍提取全部信号，再按同样次序判定"""
+    sig = _extract_sportsexperts_signals(html)
+    with METRICS.span("se_decide"):
+        available, step = _decide_sportsexperts_step(html, sig)
+    METRICS.inc("sportsexperts_decisions_total", step=step, available=str(available).lower())
+    return available
 
+def _decide_sportsexperts(html: str, sig: dict) -> bool:
+    return _decide_sportsexperts_step(html, sig)[0]
+
+def _decide_sportsexperts_step(html: str, sig: dict) -> tuple:
+    """返回 (是否有货, 命中的判定步骤)"""
     if DEBUG:
         print("[sportsexperts][DEBUG] 页面长度:", len(html), flush=True)
         if _is_incapsula_block(html):
             print("[sportsexperts][DEBUG] 疑似防护页，占位 HTML。", flush=True)
 
     # 1) 结构化/内联 JSON（最稳）
-    avail = _parse_jsonld_availability(soup)
-    if avail is None:
-        avail = _parse_microdata_availability(soup)
-    if avail is None:
-        avail = _parse_inline_json_availability(html)
+    avail = sig["structured"]
     if avail is True:
         if DEBUG: print("[sportsexperts] availability(JSON) => True", flush=True)
-        return True
+        return True, "structured"
     if avail is False:
         if DEBUG: print("[sportsexperts] availability(JSON) => False", flush=True)
-        return False
+        return False, "structured"
 
     # 2) 可点击的 Add to Cart
-    if _has_add_to_cart(soup):
+    if sig["add_to_cart"]:
         if DEBUG: print("[sportsexperts] 可点击 Add to Cart => True", flush=True)
-        return True
+        return True, "add_to_cart"
 
     # 2.5) 可选兜底：发现可选尺码也认为“有货”
-    if _any_size_enabled(soup):
+    if sig["size_enabled"]:
         if DEBUG: print("[sportsexperts] 检到可选尺码 => 视为有货(True)", flush=True)
-        return True
+        return True, "size"
 
     # 3) 激进兜底（可配置）：源码含 add-to-cart 关键字，但选择器未命中
     raw = html.lower()
+    plain = sig["text"].lower()
     if AGGRESSIVE_ATC_FALLBACK and (("product-add-to-cart" in raw) or ("addlineitem" in raw) or ("add to cart" in raw)):
-        plain = soup.get_text(" ", strip=True).lower()
         if not any(x in plain for x in _AVAIL_NEG_PATTERNS):
             if DEBUG: print("[sportsexperts] 兜底：源码含 add-to-cart 关键字 => True", flush=True)
-            return True
+            return True, "aggressive"
         else:
             if DEBUG: print("[sportsexperts] 兜底被文案否决（有无货/门店专售提示）", flush=True)
 
     # 4) 常见“无货/仅门店”文案（线上视为无货）
-    plain = soup.get_text(" ", strip=True).lower()
     if any(x in plain for x in _AVAIL_NEG_PATTERNS):
         if DEBUG: print("[sportsexperts] 文案命中无货/门店专售 => False", flush=True)
-        return False
+        return False, "negative_text"
 
     if DEBUG: print("[sportsexperts] 未识别到明确有货信号 => False", flush=True)
-    return False
+    return False, "default"
 
-# ===== 主循环 =====
-if __name__ == "__main__":
-    print("开始监控多个商品库存状态...", flush=True)
-    last_status_all = {}
+# ===== 站点适配器：每个零售商的抓取/解析/判定都在这里 =====
+_ADAPTERS = {}   # site -> SiteAdapter
 
-    while True:
-        all_messages = []
+def register_adapter(adapter: "SiteAdapter") -> "SiteAdapter":
+    """注册（或替换）一个站点；关注项里的 site 字段按 adapter.name 匹配"""
+    _ADAPTERS[adapter.name] = adapter
+    return adapter
+
+def get_adapter(site: str) -> "SiteAdapter":
+    try:
+        return _ADAPTERS[site]
+    except KeyError:
+        raise ValueError(f"未知站点: {site}") from None
+
+def adapter_for_url(url: str):
+    """按域名找适配器（直接调用 http_get 的场景）；找不到返回 None"""
+    host = _host_of(url)
+    for adapter in _ADAPTERS.values():
+        if any(host == h or host.endswith("." + h) for h in adapter.hosts):
+            return adapter
+    return None
+
+def variant_index(options):
+    """
+    [{"color","size","disabled"}, ...] -> {"colors": {颜色键: 是否有未禁用的选项}, "variants": {(颜色键, 尺码键): 是否可选}}，
+    每个页面解析后只建一次，之后每个关注项都是字典查找。
+    同一颜色尺码出现多次时以最后一个为准（与 evaluate_trailhead 一致）。
+    """
+    if options is None:
+        return None
+    colors, variants = {}, {}
+    for opt in options:
+        ck = _norm_key(opt["color"])
+        colors[ck] = colors.get(ck, False) or not opt["disabled"]
+        variants[(ck, _norm_key(opt["size"]))] = not opt["disabled"]
+    return {"colors": colors, "variants": variants}
+
+class SiteAdapter:
+    """
+    一个零售商站点的全部差异点，新站点继承后 register_adapter(...) 即可：
+      warmup        首次请求前的准备（Cookie 等），默认无
+      fetch         拿到原始响应（默认 http_get，支持条件请求，304 返回 None）
+      is_blocked / rescue   识别拦截页，以及拿什么兜底
+      fingerprint   库存相关片段的摘要，None 表示不走指纹缓存
+      stream_watcher  流式下载时判断信号是否已完整（可选）
+      parse         原始响应 -> 页面结果（每个 URL 每轮最多一次，结果可缓存）
+      evaluate      页面结果 + 关注项 -> 标准化状态：{尺码: bool}，无尺码为 {"__any__": bool}
+    parse_in_pool 为 True 时（解析是 CPU 大头的站点）parse 在解析进程池里跑，结果必须可 pickle。
+    concurrency / budget_per_min 覆盖该站点每个 host 的并发数与每分钟检查数（None 用全局配置）。
+    """
+
+    name = ""
+    hosts = ()
+    concurrency = None
+    budget_per_min = None
+    parse_in_pool = False
+
+    def warmup(self):
+        pass
+
+    def fetch(self, url: str, conditional: bool = False):
+        return http_get(url, conditional=conditional, adapter=self)
+
+    def is_blocked(self, body: str) -> bool:
+        return False
+
+    def rescue(self, url: str, body: str) -> str:
+        return body
 
-        for product in PRODUCTS:
-            site  = product["site"]
-            name  = product["name"]
-            url   = product["url"]
-            color = product["color"]
-            sizes = product["sizes"]
+    def fingerprint(self, body: str):
+        return None
+
+    def stream_watcher(self):
+        """返回 _StreamWatcher 则流式下载、信号到手即断开；None 表示总是读完整个响应"""
+        return None
+
+    def parse(self, body: str):
+        raise NotImplementedError
+
+    def evaluate(self, watch: dict, page) -> dict:
+        """默认 page 是 variant_index 建好的颜色/尺码索引"""
+        color_key, size_keys = _watch_keys(watch)
+        if page is None:
+            if DEBUG: print(f"[{self.name}] 页面上没有找到款式信息，视为不可选", flush=True)
+            return {"__any__": False} if not size_keys else {s: False for s in size_keys.values()}
+        if not size_keys:
+            return {"__any__": page["colors"].get(color_key, False)}
+        variants = page["variants"]
+        return {label: variants.get((color_key, sk), False) for sk, label in size_keys.items()}
+
+class JsonInventoryAdapter(SiteAdapter):
+    """
+    直接请求零售商的库存 JSON 接口，不下载/渲染整页 HTML。子类给出：
+      endpoint(url)   商品页 URL -> 接口 URL（默认原样请求，关注项里也可以直接写接口地址）
+      variants(data)  json.loads 后的数据 -> [{"color", "size", "disabled"}, ...]
+    响应体整体做指纹，接口数据没变就不再解析。
+    """
 
-            key = (site, name, color)
+    headers = {"Accept": "application/json"}
 
+    def endpoint(self, url: str) -> str:
+        return url
+
+    def fetch(self, url: str, conditional: bool = False):
+        return http_get(self.endpoint(url), conditional=conditional, adapter=self, headers=self.headers)
+
+    def fingerprint(self, body: str):
+        return _body_fingerprint(body)
+
+    def parse(self, body: str):
+        return variant_index(self.variants(json.loads(body)))
+
+    def variants(self, data) -> list:
+        raise NotImplementedError
+
+class ShopifyJsonAdapter(JsonInventoryAdapter):
+    """
+    Shopify 店铺：商品页 .../products/<handle> 对应公开的 .../products/<handle>.js，
+    里面每个款式有 option1..3 与 available。颜色/尺码按 options 的名字认（Color / Colour / Couleur、Size / Taille）。
+    默认不注册，用到哪家店就注册一个实例：
+        register_adapter(ShopifyJsonAdapter("somestore", ("somestore.com",)))
+    """
+
+    _COLOR_NAMES = ("color", "colour", "couleur")
+    _SIZE_NAMES  = ("size", "taille")
+
+    def __init__(self, name: str, hosts: tuple):
+        self.name = name
+        self.hosts = tuple(hosts)
+
+    def endpoint(self, url: str) -> str:
+        parts = urlsplit(url)
+        path = parts.path.rstrip("/")
+        if not path.endswith(".js"):
+            path += ".js"
+        return f"{parts.scheme}://{parts.netloc}{path}"
+
+    def variants(self, data) -> list:
+        names = [str(o.get("name", "") if isinstance(o, dict) else o).strip().lower() for o in data.get("options") or []]
+        pick = lambda wanted: next((f"option{i + 1}" for i, n in enumerate(names) if n in wanted), None)
+        color_opt, size_opt = pick(self._COLOR_NAMES), pick(self._SIZE_NAMES)
+        return [
+            {"color": str(v.get(color_opt) or "") if color_opt else "",
+             "size": str(v.get(size_opt) or "") if size_opt else "",
+             "disabled": not v.get("available", False)}
+            for v in data.get("variants") or []
+        ]
+
+class TrailheadAdapter(SiteAdapter):
+    name = "trailhead"
+    hosts = ("trailheadpaddleshack.ca",)
+
+    def fingerprint(self, html: str):
+        return _trailhead_fingerprint(html)
+
+    def stream_watcher(self):
+        # #prodattr2 闭合后，快速路径取到的片段与整页一致
+        return _StreamWatcher(_TRAILHEAD_SELECT_START_RE, _SELECT_END_RE,
+                              lambda _, head: _TRAILHEAD_SELECT_RE.search(head()) is not None)
+
+    def parse(self, html: str):
+        return variant_index(parse_trailhead_options(html))
+
+class SportsExpertsAdapter(SiteAdapter):
+    """整页只判断是否有货（与颜色/尺码无关）；Incapsula 拦截时 Playwright -> ScraperAPI 兜底"""
+
+    name = "sportsexperts"
+    hosts = ("sportsexperts.ca",)
+    parse_in_pool = True   # 单遍扫描整页 + 启发式判定，纯 Python、吃 CPU
+
+    def warmup(self):
+        _warmup_sportsexperts()
+
+    def is_blocked(self, html: str) -> bool:
+        return _is_incapsula_block(html)
+
+    def rescue(self, url: str, html: str) -> str:
+        print("[sportsexperts] 命中 Incapsula 拦截页", flush=True)
+        with METRICS.span("fallback_playwright"):
+            alt = _http_get_via_playwright(url)
+        METRICS.inc("fallback_total", kind="playwright", result="ok" if alt else "empty")
+        if alt:
+            if DEBUG: print("[sportsexperts][DEBUG] Playwright 渲染长度:", len(alt), flush=True)
+            return alt
+        if SCRAPERAPI_KEY:
+            with METRICS.span("fallback_scraperapi"):
+                alt = _http_get_via_scraperapi(url)
+            METRICS.inc("fallback_total", kind="scraperapi", result="ok" if alt else "empty")
+            if alt:
+                if DEBUG: print("[sportsexperts][DEBUG] 代理渲染长度:", len(alt), flush=True)
+                return alt
+        return html
+
+    def fingerprint(self, html: str):
+        return _sportsexperts_fingerprint(html)
+
+    def stream_watcher(self):
+        # JSON-LD 是判定的第一步，第一段给出 availability 的就决定结果，后面的内容都不看了；
+        # 候选片段先自己判断一次，再用单遍提取器核对前缀（排除注释里的 script 之类）。
+        # 提取器在整次下载里只有一个，每次只喂上次核对之后新到的部分，前缀不会重复扫描；
+        # 确认后把它交给随后的解析（_extract_sportsexperts_signals）接着用
+        signals, fed = _SportsExpertsSignals(), [0]
+        _prime_sportsexperts_signals("", None)
+
+        def confirm(raw, head):
+            if _jsonld_availability([raw]) is None:
+                return False
+            text = head()
+            signals.feed(text[fed[0]:])
+            fed[0] = len(text)
+            if _jsonld_availability(signals.jsonld) is None:
+                return False
+            _prime_sportsexperts_signals(text, signals)
+            return True
+        return _StreamWatcher(_JSONLD_START_RE, _SCRIPT_END_RE, confirm)
+
+    def parse(self, html: str):
+        return parse_sportsexperts_availability(html)
+
+    def evaluate(self, watch: dict, page) -> dict:
+        return {"__any__": bool(page)}
+
+register_adapter(TrailheadAdapter())
+register_adapter(SportsExpertsAdapter())
+
+# ===== 解析进程池：解析不和网络 I/O 抢 GIL =====
+def _parse_in_worker(site: str, body: str) -> tuple:
+    """
+    子进程里执行：按内置注册表找适配器解析，返回 (小而可 pickle 的结果, 本页的指标快照)。
+    子进程的 METRICS 没人读取，每页换一份新的，解析时记下的 span / 判定步骤计数交给父进程合并
+    """
+    global METRICS
+    METRICS = _Metrics()
+    return get_adapter(site).parse(body), METRICS.snapshot()
+
+class _ParsePool:
+    """
+    抓取线程把原始页面交给子进程解析，只取回很小的结果（bool / 颜色尺码索引）：
+      - 同时在解析的页面不超过 queue_size，满了抓取线程就等（背压，不会无限堆积页面）
+      - 每个子进程解析 max_tasks 页后换新，解析器的内存碎片不会越积越多
+      - 进程池崩了就重建，这一页退回当前线程解析
+    """
+
+    def __init__(self, workers: int, queue_size: int, max_tasks: int):
+        self.workers = workers
+        self.max_tasks = max_tasks
+        self._slots = threading.BoundedSemaphore(max(1, queue_size))
+        self._lock = threading.Lock()
+        self._pool = None
+        self._inflight = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks or None,
+                )
+            return self._pool
+
+    def _track(self, delta: int):
+        with self._lock:
+            self._inflight += delta
+            METRICS.set("parse_pool_inflight", self._inflight)
+
+    def parse(self, adapter: "SiteAdapter", body: str):
+        waited = time.perf_counter()
+        with self._slots:
+            METRICS.observe("parse_pool_wait_seconds", time.perf_counter() - waited)
+            pool = self._get_pool()
+            self._track(1)
             try:
-                if site == "trailhead":
-                    current_status = check_stock_trailhead(url, color, sizes)
-                    last_status    = last_status_all.get(key, {})
-
-                    if sizes:  # 有尺码
-                        if current_status != last_status:
-                            in_stock  = [s for s, ok in current_status.items() if ok]
-                            out_stock = [s for s, ok in current_status.items() if not ok]
-                            msg = f"trailhead {name} - {color}\n"
-                            if in_stock:
-                                msg += "✅ 有库存: " + ", ".join(in_stock) + "\n"
-                            if out_stock:
-                                msg += "❌ 无库存: " + ", ".join(out_stock)
-                            all_messages.append(msg)
-                            last_status_all[key] = current_status
-                        print(f"[trailhead] {name} - {color} 状态: {current_status}", flush=True)
-
-                    else:      # 无尺码
-                        available = bool(current_status.get("__any__", False))
-                        last_available = (
-                            last_status.get("__any__", None) if isinstance(last_status, dict) else None
-                        )
-                        if available != last_available:
-                            msg = f"trailhead {name} - {color}\n"
-                            msg += "✅ 有库存" if available else "❌ 无库存"
-                            all_messages.append(msg)
-                            last_status_all[key] = current_status
-                        print(f"[trailhead] {name} - {color} 状态: {'有货' if available else '无货'}", flush=True)
-
-                elif site == "sportsexperts":
-                    in_stock = check_stock_sportsexperts(url)
-                    last_status = last_status_all.get(key)  # bool 或 None
-                    if in_stock != last_status:
-                        msg = f"sportsexperts {name} - {color}\n"
-                        msg += "✅ 有库存" if in_stock else "❌ 无库存"
-                        all_messages.append(msg)
-                        last_status_all[key] = in_stock
-                    print(f"[sportsexperts] {name} - {color} 状态: {'有货' if in_stock else '无货'}", flush=True)
+                result, metrics = pool.submit(_parse_in_worker, adapter.name, body).result()
+                METRICS.merge(metrics)
+                return result
+            except BrokenProcessPool:
+                print("解析进程池异常退出，已重建；本页改在当前线程解析", flush=True)
+                METRICS.inc("parse_pool_restarts_total")
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            finally:
+                self._track(-1)
+        return adapter.parse(body)
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+_PARSE_POOL = _ParsePool(PARSE_WORKERS, PARSE_QUEUE_SIZE, PARSE_MAX_TASKS_PER_CHILD) if PARSE_WORKERS > 0 else None
+if _PARSE_POOL is not None:
+    atexit.register(_PARSE_POOL.close)
+
+def parse_page(adapter: "SiteAdapter", body: str):
+    """按适配器设置决定在进程池还是当前线程解析"""
+    if _PARSE_POOL is not None and adapter.parse_in_pool:
+        return _PARSE_POOL.parse(adapter, body)
+    return adapter.parse(body)
+
+# ===== 单个页面：抓取解析 + 分发到各个关注项 =====
+def check_page(site: str, url: str):
+    """
+    每个 URL 每轮只抓取、解析一次，返回站点适配器 parse 的结果
+    （trailhead 为颜色/尺码索引或 None，sportsexperts 为整页是否有货）。
+    有上次结果时发条件请求；304 或库存片段指纹未变则直接复用上次结果，不再解析。
+    """
+    try:
+        return _check_page(site, url)
+    finally:
+        _prime_sportsexperts_signals("", None)
+
+def _check_page(site: str, url: str):
+    adapter = get_adapter(site)
+    key = (site, url)
+    with _PAGE_CACHE_LOCK:
+        cached = _PAGE_CACHE.get(key)
+    fresh = cached is not None and time.time() - cached["parsed_at"] < FINGERPRINT_MAX_AGE_SEC
+
+    body = adapter.fetch(url, conditional=fresh)
+    if body is None:
+        return cached["result"]
+
+    fingerprint = adapter.fingerprint(body)
+    if fresh and fingerprint is not None and fingerprint == cached["fingerprint"]:
+        if DEBUG: print(f"[DEBUG] 库存片段未变化，复用上次结果: {url}", flush=True)
+        METRICS.inc("page_cache_hits_total", reason="fingerprint")
+        return cached["result"]
+
+    with METRICS.span("parse", site=site):
+        result = parse_page(adapter, body)
+
+    with _PAGE_CACHE_LOCK:
+        if fingerprint is None:
+            _PAGE_CACHE.pop(key, None)
+        else:
+            _PAGE_CACHE[key] = {"fingerprint": fingerprint, "result": result, "parsed_at": time.time()}
+    return result
 
+def evaluate_watch(product: dict, page) -> dict:
+    """把 check_page 的结果套到单个关注项上，返回 {尺码: bool} 或 {"__any__": bool}"""
+    return (product.get("adapter") or get_adapter(product["site"])).evaluate(product, page)
+
+def _normalize_state(state):
+    """旧版本给 sportsexperts 存的是 bool，统一成 {"__any__": bool}"""
+    if state is None or isinstance(state, dict):
+        return state
+    return {"__any__": bool(state)}
+
+def diff_product_status(product: dict, current_status: dict, last_status_all: dict):
+    """与上次状态对比：有变化时更新 last_status_all 并返回推送文案，否则返回 None"""
+    site  = product["site"]
+    name  = product["name"]
+    color = product["color"]
+    key   = (site, name, color)
+    last_status = _normalize_state(last_status_all.get(key))
+    msg   = None
+
+    if "__any__" in current_status:   # 无尺码
+        available = bool(current_status["__any__"])
+        last_available = last_status.get("__any__") if last_status else None
+        if available != last_available:
+            msg = f"{site} {name} - {color}\n"
+            msg += "✅ 有库存" if available else "❌ 无库存"
+            last_status_all[key] = current_status
+        print(f"[{site}] {name} - {color} 状态: {'有货' if available else '无货'}", flush=True)
+
+    else:                             # 有尺码
+        if current_status != last_status:
+            in_stock  = [s for s, ok in current_status.items() if ok]
+            out_stock = [s for s, ok in current_status.items() if not ok]
+            msg = f"{site} {name} - {color}\n"
+            if in_stock:
+                msg += "✅ 有库存: " + ", ".join(in_stock) + "\n"
+            if out_stock:
+                msg += "❌ 无库存: " + ", ".join(out_stock)
+            last_status_all[key] = current_status
+        print(f"[{site}] {name} - {color} 状态: {current_status}", flush=True)
+
+    return msg
+
+# ===== 关注列表：外部配置文件 + 热加载 =====
+_WATCHLIST_SUFFIXES = (".yaml", ".yml", ".json", ".toml")
+
+def _norm_key(value: str) -> str:
+    """颜色/尺码比较用的键：忽略大小写与多余空白（"Cloud Heather/Void" == "cloud heather / void"）"""
+    return " ".join(str(value).replace("/", " / ").split()).casefold()
+
+def _watch_keys(product: dict) -> tuple:
+    """(颜色键, {尺码键: 原尺码}）；编译过的关注项直接取现成的"""
+    if "color_key" in product:
+        return product["color_key"], product["size_keys"]
+    return _norm_key(product["color"]), {_norm_key(s): s for s in product["sizes"]}
+
+def compile_watch(raw: dict, where: str = "") -> dict:
+    """
+    校验一条关注项并预先算好轮询时要用的东西：
+      key        (site, name, color)，状态库与推送去重用
+      group      (site, url)，同一页面只抓一次
+      adapter    负责该站点抓取与解析的 SiteAdapter
+      color_key / size_keys  归一化后的匹配键
+    格式不对抛 ValueError。
+    """
+    if not isinstance(raw, dict):
+        raise ValueError(f"{where}: 应为键值表，实际是 {type(raw).__name__}")
+    site = str(raw.get("site", "")).strip().lower()
+    if site not in _ADAPTERS:
+        raise ValueError(f"{where}: 未知站点 {raw.get('site')!r}（可选: {', '.join(_ADAPTERS)}）")
+    name = str(raw.get("name", "")).strip()
+    url = str(raw.get("url", "")).strip()
+    if not name:
+        raise ValueError(f"{where}: 缺少 name")
+    if not url.startswith(("http://", "https://")):
+        raise ValueError(f"{where}: url 无效 {url!r}")
+    color = str(raw.get("color") or "").strip()
+    sizes = raw.get("sizes") or []
+    if isinstance(sizes, str):
+        sizes = sizes.split(",")
+    if not isinstance(sizes, list):
+        raise ValueError(f"{where}: sizes 应为列表或逗号分隔的字符串")
+    sizes = [str(x).strip() for x in sizes if str(x).strip()]
+    size_keys = {}
+    for size in sizes:
+        size_keys.setdefault(_norm_key(size), size)
+    return {
+        "site": site, "name": name, "url": url, "color": color, "sizes": list(size_keys.values()),
+        "key": (site, name, color), "group": (site, url), "adapter": _ADAPTERS[site],
+        "color_key": _norm_key(color), "size_keys": size_keys,
+    }
+
+def compile_watches(entries: list) -> list:
+    """[(来源, 原始关注项), ...] -> 编译后的列表；无效项与重复项打印后跳过，不影响其余"""
+    watches, seen = [], set()
+    for where, raw in entries:
+        try:
+            watch = compile_watch(raw, where)
+        except ValueError as e:
+            print(f"关注项无效，已跳过 {e}", flush=True)
+            continue
+        if watch["key"] in seen:
+            print(f"关注项重复，已跳过 {where}: {watch['key']}", flush=True)
+            continue
+        seen.add(watch["key"])
+        watches.append(watch)
+    return watches
+
+def _load_watch_file(path: str) -> list:
+    """读一个配置文件，返回原始关注项列表；支持顶层列表，或 watches / products 键下的列表"""
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == ".toml":
+        import tomllib
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    elif suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    else:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("读取 YAML 需要安装 PyYAML（pip install pyyaml），或改用 JSON / TOML")
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+    if isinstance(data, dict):
+        data = data.get("watches", data.get("products"))
+    if data is None:
+        return []
+    if not isinstance(data, list):
+        raise ValueError("顶层应为列表，或包含 watches 列表")
+    return data
+
+class _WatchList:
+    """
+    从文件（或目录下所有 .yaml/.yml/.json/.toml，按文件名排序）加载关注列表。
+    poll() 按文件 mtime/大小判断是否改动，改了就重新加载；新配置有错时保留上一份。
+    """
+
+    def __init__(self, path: str, fallback: list = None):
+        self.path = path
+        self.fallback = fallback or []
+        self.products = []
+        self._signature = None
+        self._checked_at = 0.0
+        if path:
+            self.poll(force=True)
+        else:
+            self.products = compile_watches([(f"PRODUCTS[{i}]", p) for i, p in enumerate(self.fallback)])
+
+    def _files(self) -> list:
+        if os.path.isdir(self.path):
+            return sorted(os.path.join(self.path, n) for n in os.listdir(self.path)
+                          if n.lower().endswith(_WATCHLIST_SUFFIXES) and not n.startswith("."))
+        return [self.path] if os.path.exists(self.path) else []
+
+    def _stat(self, files: list) -> tuple:
+        sig = []
+        for path in files:
+            st = os.stat(path)
+            sig.append((path, st.st_mtime_ns, st.st_size))
+        return tuple(sig)
+
+    def poll(self, force: bool = False) -> bool:
+        """到了检查时间且文件有变化则重新加载；返回 products 是否被替换"""
+        if not self.path:
+            return False
+        now = time.monotonic()
+        if not force and now - self._checked_at < WATCHLIST_RELOAD_SEC:
+            return False
+        self._checked_at = now
+        try:
+            files = self._files()
+            signature = self._stat(files)
+        except OSError as e:
+            print(f"检查关注列表失败: {e}", flush=True)
+            return False
+        if signature == self._signature:
+            return False
+        if not files:
+            print(f"关注列表 {self.path} 不存在", flush=True)
+            self._signature = signature
+            return False
+
+        entries = []
+        try:
+            for path in files:
+                entries.extend((f"{os.path.basename(path)}[{i}]", raw) for i, raw in enumerate(_load_watch_file(path)))
+        except Exception as e:
+            # 多半是编辑到一半：保留旧列表，不记签名，下次再试
+            print(f"读取关注列表失败（沿用上一份）: {path}: {e}", flush=True)
+            return False
+        self._signature = signature
+        started = time.perf_counter()
+        self.products = compile_watches(entries)
+        print(f"已加载关注列表 {len(self.products)} 项（{len(files)} 个文件，{(time.perf_counter() - started) * 1000:.0f}ms）", flush=True)
+        return True
+
+# ===== 状态持久化 =====
+def _is_in_stock(state) -> bool:
+    """trailhead 状态为 {尺码/__any__: bool}，sportsexperts 为 bool；任一为 True 即算有货"""
+    if isinstance(state, dict):
+        return any(state.values())
+    return bool(state)
+
+class _StatusStore:
+    """
+    每个 (site, name, color) 的最后状态、最后变化时间和抓取信息：
+      - load() 启动时恢复 last_status_all，重启/重新部署不会把所有商品再推送一遍
+      - commit(records) 每轮批量写一次
+      - history(key) / in_stock_periods(key) 查询历史（比如某款有货持续了多久）
+    records 每项：{"key", "at", "state", "changed", "fetch_ms", "error"}（失败时可能另有 "retry_at"；
+    首次看到的状态 changed 为 True 且 "first_seen" 为 True，要存下来，但不算状态变化）
+    """
+
+    def load(self) -> dict:
+        return {}
+
+    def commit(self, records: list):
+        pass
+
+    def history(self, key: tuple) -> list:
+        return []
+
+    def keys(self) -> list:
+        return []
+
+    def last_changed_at(self) -> dict:
+        """{key: 最后一次状态变化的时间戳}，调度器据此判断冷热；只有首次记录的状态不算变化"""
+        return {key: hist[-1][0] for key in self.keys() for hist in [self.history(key)] if len(hist) > 1}
+
+    def in_stock_periods(self, key: tuple, now: float = None) -> list:
+        """[(开始, 结束), ...]，仍有货的那段结束时间为 now"""
+        now = time.time() if now is None else now
+        periods, start = [], None
+        for at, state in self.history(key):
+            if _is_in_stock(state):
+                if start is None:
+                    start = at
+            elif start is not None:
+                periods.append((start, at))
+                start = None
+        if start is not None:
+            periods.append((start, now))
+        return periods
+
+class _SqliteStatusStore(_StatusStore):
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS status (
+                    site TEXT NOT NULL, name TEXT NOT NULL, color TEXT NOT NULL,
+                    state TEXT, changed_at REAL, checked_at REAL, fetch_ms REAL, error TEXT,
+                    PRIMARY KEY (site, name, color)
+                );
+                CREATE TABLE IF NOT EXISTS history (
+                    site TEXT NOT NULL, name TEXT NOT NULL, color TEXT NOT NULL,
+                    state TEXT NOT NULL, at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS history_key ON history (site, name, color, at);
+            """)
+
+    def load(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT site, name, color, state FROM status WHERE state IS NOT NULL").fetchall()
+        return {(site, name, color): json.loads(state) for site, name, color, state in rows}
+
+    def commit(self, records: list):
+        if not records:
+            return
+        changes, metas = [], []
+        for r in records:
+            site, name, color = r["key"]
+            if r["changed"]:
+                changes.append((site, name, color, json.dumps(r["state"]), r["at"]))
+            metas.append((site, name, color, r["at"], r["fetch_ms"], r["error"]))
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO status (site, name, color, checked_at, fetch_ms, error) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (site, name, color) DO UPDATE SET "
+                "checked_at = excluded.checked_at, fetch_ms = excluded.fetch_ms, error = excluded.error",
+                metas)
+            self._db.executemany(
+                "UPDATE status SET state = ?4, changed_at = ?5 WHERE site = ?1 AND name = ?2 AND color = ?3",
+                changes)
+            self._db.executemany("INSERT INTO history (site, name, color, state, at) VALUES (?, ?, ?, ?, ?)", changes)
+
+    def history(self, key: tuple) -> list:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT at, state FROM history WHERE site = ? AND name = ? AND color = ? ORDER BY at", key).fetchall()
+        return [(at, json.loads(state)) for at, state in rows]
+
+    def keys(self) -> list:
+        with self._lock:
+            return [tuple(r) for r in self._db.execute("SELECT site, name, color FROM status ORDER BY site, name, color")]
+
+    def last_changed_at(self) -> dict:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT site, name, color, MAX(at) FROM history GROUP BY site, name, color HAVING COUNT(*) > 1")
+            return {(site, name, color): at for site, name, color, at in rows}
+
+class _FileStatusStore(_StatusStore):
+    """
+    追加写 JSON Lines：状态变化记 {"k","s","at"}，抓取信息记 {"k","m"}。
+    行数超过 STATUS_FILE_COMPACT_LINES 时重写：保留全部状态变化，抓取信息每个 key 只留最后一条。
+    """
+
+    def __init__(self, path: str, compact_lines: int):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.compact_lines = compact_lines
+        self._lock = threading.Lock()
+        self._history = defaultdict(list)   # key -> [(at, state)]
+        self._meta = {}                     # key -> {"checked_at", "fetch_ms", "error"}
+        self._lines = 0
+        self._replay()
+
+    def _replay(self):
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                self._lines += 1
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue  # 上次写到一半被杀掉的残行
+                key = tuple(rec["k"])
+                if "s" in rec:
+                    self._history[key].append((rec["at"], rec["s"]))
                 else:
-                    print(f"未知站点: {site}，已跳过", flush=True)
+                    self._meta[key] = rec["m"]
+
+    def load(self) -> dict:
+        with self._lock:
+            return {key: hist[-1][1] for key, hist in self._history.items() if hist}
+
+    def commit(self, records: list):
+        if not records:
+            return
+        lines = []
+        with self._lock:
+            for r in records:
+                key = tuple(r["key"])
+                meta = {"checked_at": r["at"], "fetch_ms": r["fetch_ms"], "error": r["error"]}
+                if r["changed"]:
+                    self._history[key].append((r["at"], r["state"]))
+                    lines.append(json.dumps({"k": list(key), "s": r["state"], "at": r["at"]}, ensure_ascii=False))
+                self._meta[key] = meta
+                lines.append(json.dumps({"k": list(key), "m": meta}, ensure_ascii=False))
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self._lines += len(lines)
+            if self._lines > self.compact_lines:
+                self._compact()
+
+    def _compact(self):
+        lines = []
+        for key, hist in self._history.items():
+            for at, state in hist:
+                lines.append(json.dumps({"k": list(key), "s": state, "at": at}, ensure_ascii=False))
+        for key, meta in self._meta.items():
+            lines.append(json.dumps({"k": list(key), "m": meta}, ensure_ascii=False))
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, self.path)
+        self._lines = len(lines)
+
+    def history(self, key: tuple) -> list:
+        with self._lock:
+            return list(self._history.get(tuple(key), []))
+
+    def keys(self) -> list:
+        with self._lock:
+            return sorted(set(self._history) | set(self._meta))
+
+def open_status_store(kind: str = None) -> _StatusStore:
+    kind = STATUS_STORE if kind is None else kind
+    if kind == "sqlite":
+        return _SqliteStatusStore(os.path.join(STATE_DIR, "status.sqlite3"))
+    if kind == "file":
+        return _FileStatusStore(os.path.join(STATE_DIR, "status.jsonl"), STATUS_FILE_COMPACT_LINES)
+    if kind != "none":
+        print(f"未知 STATUS_STORE={kind}，状态只保存在内存", flush=True)
+    return _StatusStore()
+
+def print_stock_history(store: _StatusStore):
+    """python main.py --history：列出每个商品的有货时段与累计时长"""
+    for key in store.keys():
+        periods = store.in_stock_periods(key)
+        total = sum(end - start for start, end in periods)
+        print(f"{key[0]} {key[1]} - {key[2]}: 有货 {len(periods)} 次，累计 {total / 3600:.1f} 小时", flush=True)
+        for start, end in periods:
+            print(f"    {dt.datetime.fromtimestamp(start):%Y-%m-%d %H:%M} -> "
+                  f"{dt.datetime.fromtimestamp(end):%Y-%m-%d %H:%M}（{(end - start) / 3600:.1f} 小时）", flush=True)
+
+# ===== 并发轮询 =====
+_EXECUTOR = None
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=max(1, MAX_WORKERS), thread_name_prefix="check")
+    return _EXECUTOR
+
+def _check_page_timed(site: str, url: str):
+    """在工作线程里跑 check_page，返回 (结果, 耗时毫秒, 异常)"""
+    started = time.monotonic()
+    try:
+        return check_page(site, url), (time.monotonic() - started) * 1000, None
+    except Exception as e:
+        return None, (time.monotonic() - started) * 1000, e
+
+def apply_page_result(group: tuple, products: list, result: tuple, last_status_all: dict, notify=None) -> list:
+    """
+    把一个页面的 _check_page_timed 结果分发给它下面的关注项：对比状态、推送变化，
+    返回要写入 store 的 records。只在主线程调用，last_status_all 无需加锁。
+    """
+    site, _ = group
+    page, fetch_ms, err = result
+    now = time.time()
+    records = []
+    for product in products:
+        key = (site, product["name"], product["color"])
+        if err is not None:
+            if isinstance(err, HostUnavailableError):
+                print(f"[{site}] {product['name']} - {product['color']} 状态: 未知（{err}）", flush=True)
+            elif isinstance(err, requests.HTTPError):
+                print(f"请求失败 {site} {product['name']} - {product['color']}: HTTP {err.response.status_code}", flush=True)
+            else:
+                print(f"请求失败 {site} {product['name']} - {product['color']}: {err}", flush=True)
+            records.append({"key": key, "at": now, "state": None, "changed": False,
+                            "fetch_ms": fetch_ms, "error": str(err),
+                            "retry_at": getattr(err, "retry_at", None)})
+            continue
+        try:
+            current = evaluate_watch(product, page)
+            first_seen = last_status_all.get(key) is None
+            msg = diff_product_status(product, current, last_status_all)
+            if msg:
+                if notify is None:
+                    send_discord_message(msg)
+                else:
+                    notify(key, current, msg)
+            records.append({"key": key, "at": now, "state": current, "changed": msg is not None,
+                            "first_seen": first_seen, "fetch_ms": fetch_ms, "error": None})
+        except Exception as e:
+            print(f"处理失败 {site} {product['name']} - {product['color']}: {e}", flush=True)
+    return records
+
+def run_cycle(products: list, last_status_all: dict, store: _StatusStore = None, notify=None):
+    """
+    并发检查一轮：
+      - 按 (site, url) 分组，同一页面只抓取解析一次，结果分发给该 URL 下所有颜色/尺码
+      - 网络请求在线程池里跑，每个 host 的并发由 _host_semaphore 限制
+      - 状态对比只在主线程做，last_status_all 无需加锁
+      - 每个页面出结果就把变更交给后台推送队列，不等慢站点，也不等 webhook
+      - 本轮结束后把状态与抓取信息一次性写入 store
+    notify(key, state, msg) 替换默认的 Discord 推送（分片模式交给协调者去重）。
+    """
+    pool = _get_executor()
+    groups = defaultdict(list)   # (site, url) -> [product, ...]
+    for product in products:
+        if product["site"] not in _ADAPTERS:
+            print(f"未知站点: {product['site']}，已跳过", flush=True)
+            continue
+        groups[product.get("group") or (product["site"], product["url"])].append(product)
+
+    futures = {pool.submit(_check_page_timed, site, url): (site, url) for site, url in groups}
+
+    records = []
+    for fut in as_completed(futures):
+        group = futures[fut]
+        records += apply_page_result(group, groups[group], fut.result(), last_status_all, notify)
+
+    if store is not None:
+        try:
+            store.commit(records)
+        except Exception as e:
+            print(f"保存状态失败: {e}", flush=True)
+    return records
+
+# ===== 自适应调度 =====
+_WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+
+def _parse_drop_windows(spec: str) -> list:
+    """"Tue,Thu 09:00-11:00; 20:00-21:00" -> [(星期集合或 None, 开始分钟, 结束分钟), ...]"""
+    windows = []
+    for part in filter(None, (p.strip() for p in spec.split(";"))):
+        try:
+            days, _, span = part.rpartition(" ")
+            start, end = span.split("-")
+            to_min = lambda hm: int(hm.split(":")[0]) * 60 + int(hm.split(":")[1])
+            day_set = {_WEEKDAYS[d.strip().lower()[:3]] for d in days.split(",")} if days.strip() else None
+            windows.append((day_set, to_min(start), to_min(end)))
+        except Exception:
+            print(f"DROP_WINDOWS 无法解析，已忽略: {part!r}", flush=True)
+    return windows
+
+class _HostBudget:
+    """每个 host 一个令牌桶：每分钟补充 per_min 个，容量 max(1, per_min)（低于 1 时几分钟攒够一个）"""
+
+    def __init__(self, per_min: float):
+        self.per_min = per_min
+        self._buckets = {}   # host -> [tokens, updated_at]
+
+    def take(self, host: str, now: float, per_min: float = None) -> float:
+        """拿到令牌返回 0，否则返回还要等多少秒；per_min 为站点适配器给的预算（None 用全局配置）"""
+        per_min = self.per_min if per_min is None else per_min
+        if per_min <= 0:
+            return 0.0
+        capacity = max(1.0, per_min)
+        tokens, updated = self._buckets.get(host, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * per_min / 60)
+        if tokens >= 1:
+            self._buckets[host] = [tokens - 1, now]
+            return 0.0
+        self._buckets[host] = [tokens, now]
+        return (1 - tokens) * 60 / per_min
+
+class _Scheduler:
+    """
+    按页面 (site, url) 维护下次检查时间的小根堆：
+      - 最近有状态变化（HOT_WINDOW_SEC 内）或处于抢购时段：间隔缩短
+      - 长期没变化：间隔放大；连续失败：指数退避（都不超过 MAX_INTERVAL_SEC）
+      - 每次排期加随机抖动，错开请求
+      - 到期的页面还要过 host 令牌桶，超预算的顺延
+    """
+
+    def __init__(self, products: list, store: _StatusStore):
+        self._budget  = _HostBudget(HOST_BUDGET_PER_MIN)
+        self._windows = _parse_drop_windows(DROP_WINDOWS)
+        self._tz      = ZoneInfo(DROP_WINDOWS_TZ)
+        self._changed_at = dict(store.last_changed_at())   # (site, name, color) -> ts
+        self._seen_at = {}                                  # (site, name, color) -> 本进程第一次拿到状态的时间
+        self._failures = defaultdict(int)                   # (site, url) -> 连续失败次数
+        self._heap  = []                                    # [(due, seq, (site, url))]
+        self._inflight = set()                              # 已取出、还没 report 的页面
+        self._seq   = 0
+        self._groups = {}
+        self.set_products(products)
+
+    def set_products(self, products: list):
+        """更新关注列表：已有页面保留排期，新页面在接下来几秒内陆续检查；移除的页面/关注项清掉各自的状态"""
+        groups = defaultdict(list)
+        for product in products:
+            groups[product.get("group") or (product["site"], product["url"])].append(product)
+        now = time.time()
+        scheduled = {g for _, _, g in self._heap} | self._inflight
+        for group in groups:
+            if group not in scheduled:
+                self._push(group, now + random.uniform(0, min(30.0, MIN_INTERVAL_SEC)))
+        removed = set(self._groups) - set(groups)
+        if removed:
+            _forget_pages(removed)
+            for group in removed:
+                self._failures.pop(group, None)
+            live = {(p["site"], p["name"], p["color"]) for p in products}
+            for key in [k for k in self._seen_at if k not in live]:
+                del self._seen_at[key]
+            for key in [k for k in self._changed_at if k not in live]:
+                del self._changed_at[key]
+        self._groups = dict(groups)
+
+    def pop_due(self, now: float = None) -> list:
+        """取出所有到期且 host 预算允许的页面；超预算的按令牌桶给出的时间顺延"""
+        now = time.time() if now is None else now
+        due, deferred, lag = [], [], 0.0
+        while self._heap and self._heap[0][0] <= now:
+            at, _, group = heapq.heappop(self._heap)
+            if group not in self._groups:
+                continue  # 已从关注列表移除
+            open_until = _BREAKER.open_until(_host_of(group[1]))
+            if open_until > now:
+                deferred.append((group, open_until + random.uniform(0, 5)))
+                continue
+            adapter = _ADAPTERS.get(group[0])
+            wait = self._budget.take(_host_of(group[1]), now, adapter.budget_per_min if adapter else None)
+            if wait:
+                deferred.append((group, now + wait))
+            else:
+                due.append(group)
+                self._inflight.add(group)
+                lag = max(lag, now - at)
+        for group, at in deferred:
+            self._push(group, at)
+        if due:
+            METRICS.set("schedule_lag_seconds", lag)
+        return due
+
+    def products_for(self, groups: list) -> list:
+        return [p for g in groups for p in self._groups.get(g, [])]
+
+    def report(self, groups: list, records: list, now: float = None):
+        """根据这批结果更新冷热/失败计数，并重新排期"""
+        now = time.time() if now is None else now
+        failed, retry_at = set(), {}
+        for r in records:
+            if r["state"] is not None:
+                self._seen_at.setdefault(r["key"], r["at"])
+            # 首次看到的状态不算变化：否则每次新部署（或 STATUS_STORE=none 重启）所有页面都会被当成“热”的
+            if r["changed"] and not r.get("first_seen"):
+                self._changed_at[r["key"]] = r["at"]
+            if r["error"] is not None:
+                failed.add(r["key"])
+            if r.get("retry_at"):
+                retry_at[r["key"]] = r["retry_at"]
+        for group in groups:
+            self._inflight.discard(group)
+            if group not in self._groups:
+                _forget_pages([group])   # 移除时还在途：结果刚把缓存写回去
+                continue
+            keys = [(p["site"], p["name"], p["color"]) for p in self._groups[group]]
+            if any(k in failed for k in keys):
+                self._failures[group] += 1
+            else:
+                self._failures.pop(group, None)
+            resume = max((retry_at[k] for k in keys if k in retry_at), default=None)
+            if resume is not None:
+                # 熔断/限流：到 host 恢复时间再查，不按失败退避
+                self._push(group, resume + random.uniform(0, 5))
+                continue
+            interval = self.interval_for(group, keys, now)
+            self._push(group, now + interval * random.uniform(1 - SCHEDULE_JITTER, 1 + SCHEDULE_JITTER))
+
+    def interval_for(self, group: tuple, keys: list, now: float) -> float:
+        failures = self._failures.get(group, 0)
+        if failures:
+            return min(MAX_INTERVAL_SEC, INTERVAL_SEC * 2 ** failures)
+        if self._in_drop_window(now):
+            return MIN_INTERVAL_SEC
+        last_change = max((self._changed_at.get(k, 0) for k in keys), default=0)
+        if now - last_change < HOT_WINDOW_SEC:
+            return max(MIN_INTERVAL_SEC, INTERVAL_SEC * HOT_INTERVAL_FACTOR)
+        # 没有变化记录时从第一次拿到状态算起，刚开始关注的页面按正常间隔，不直接当成“稳定”
+        since = last_change or min((self._seen_at.get(k, now) for k in keys), default=now)
+        if now - since > STABLE_AFTER_SEC:
+            return min(MAX_INTERVAL_SEC, INTERVAL_SEC * STABLE_INTERVAL_FACTOR)
+        return INTERVAL_SEC
+
+    def next_due(self) -> float:
+        return self._heap[0][0] if self._heap else time.time() + INTERVAL_SEC
+
+    def _in_drop_window(self, now: float) -> bool:
+        if not self._windows:
+            return False
+        local = dt.datetime.fromtimestamp(now, self._tz)
+        minute = local.hour * 60 + local.minute
+        return any((days is None or local.weekday() in days) and start <= minute < end
+                   for days, start, end in self._windows)
+
+    def _push(self, group: tuple, due: float):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, group))
+
+# ===== 分片：多个 worker 进程/节点按 URL 一致性哈希分摊关注列表 =====
+class _HashRing:
+    """一致性哈希环：每个 worker 放 vnodes 个虚拟节点，URL 落到顺时针第一个节点；worker 增减只挪动约 1/N 的页面"""
+
+    def __init__(self, members: list, vnodes: int):
+        self.members = tuple(sorted(members))
+        self._points = sorted((self._hash(f"{m}#{i}"), m) for m in self.members for i in range(max(1, vnodes)))
+        self._keys = [h for h, _ in self._points]
 
-            except requests.HTTPError as e:
-                print(f"请求失败 {site} {name} - {color}: HTTP {e.response.status_code}", flush=True)
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def owner(self, url: str):
+        if not self._points:
+            return None
+        i = bisect.bisect(self._keys, self._hash(url)) % len(self._points)
+        return self._points[i][1]
+
+class _Coordinator:
+    """
+    基于一个 SQLite 文件的协调者，不需要额外的消息中间件：
+      members  worker 心跳租约；超过 SHARD_LEASE_SEC 没续约就视为下线，它的页面由环上的下一个 worker 接手
+      alerted  每个关注项最后一次推送过的状态：同一次变化只推送一次（交接期间两个 worker 同时查到也不重复）
+      outbox   待推送的通知；持有 "alerts" 租约的 worker 负责取出交给 Discord 队列
+    """
+
+    def __init__(self, path: str, worker_id: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.worker_id = worker_id
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS members (worker TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL, started_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, until REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS alerted (
+                site TEXT NOT NULL, name TEXT NOT NULL, color TEXT NOT NULL, state TEXT NOT NULL, at REAL NOT NULL,
+                PRIMARY KEY (site, name, color)
+            );
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, msg TEXT NOT NULL, created_at REAL NOT NULL, sent_at REAL
+            );
+        """)
+        self._started_at = time.time()
+        self._ring = _HashRing([], SHARD_VNODES)
+        self.changed = threading.Event()   # 成员变化，主循环需要重新分片
+        self._left = threading.Event()     # 已注销，后台不再续约
+
+    def start(self):
+        """
+        先登记并稍等片刻再取成员列表（同时启动的 worker 互相看得到，开局不会各自包揽全部页面），
+        之后在后台线程续约（长批次期间也不会掉线）
+        """
+        self.heartbeat()
+        time.sleep(min(5.0, SHARD_LEASE_SEC / 3))
+        self.heartbeat()
+        threading.Thread(target=self._beat, name="shard-heartbeat", daemon=True).start()
+
+    def _beat(self):
+        while not self._left.wait(SHARD_LEASE_SEC / 3):
+            try:
+                if self.heartbeat():
+                    self.changed.set()
+            except Exception as e:
+                print(f"[shard] 心跳失败: {e}", flush=True)
+
+    @contextlib.contextmanager
+    def _tx(self):
+        """BEGIN IMMEDIATE：多个进程同时写时按顺序来，读-改-写不会交错"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def heartbeat(self, now: float = None) -> bool:
+        """续约并刷新成员列表；成员有变化（需要重新分片）时返回 True"""
+        now = time.time() if now is None else now
+        with self._tx() as db:
+            db.execute("INSERT INTO members (worker, heartbeat_at, started_at) VALUES (?, ?, ?) "
+                       "ON CONFLICT(worker) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                       (self.worker_id, now, self._started_at))
+            db.execute("DELETE FROM members WHERE heartbeat_at < ?", (now - SHARD_LEASE_SEC * 10,))
+            live = [w for (w,) in db.execute("SELECT worker FROM members WHERE heartbeat_at >= ?", (now - SHARD_LEASE_SEC,))]
+        if tuple(sorted(live)) == self._ring.members:
+            return False
+        if self._ring.members:
+            print(f"[shard] 成员变化: {len(self._ring.members)} -> {len(live)} 个 worker", flush=True)
+        self._ring = _HashRing(live, SHARD_VNODES)
+        METRICS.set("shard_members", len(live))
+        return True
+
+    def owned(self, products: list) -> list:
+        """环上归自己的关注项（同一 URL 的关注项总是在同一个 worker 上）"""
+        return [p for p in products if self._ring.owner(p["url"]) == self.worker_id]
+
+    def publish(self, key: tuple, state, msg: str) -> bool:
+        """状态和上次推送的一样就丢弃（别的 worker 已经推过），否则写入 outbox；返回是否写入"""
+        encoded = json.dumps(state, sort_keys=True, ensure_ascii=False)
+        with self._tx() as db:
+            row = db.execute("SELECT state FROM alerted WHERE site = ? AND name = ? AND color = ?", key).fetchone()
+            if row is not None and row[0] == encoded:
+                METRICS.inc("shard_alerts_deduped_total")
+                return False
+            now = time.time()
+            db.execute("INSERT INTO alerted (site, name, color, state, at) VALUES (?, ?, ?, ?, ?) "
+                       "ON CONFLICT(site, name, color) DO UPDATE SET state = excluded.state, at = excluded.at",
+                       (*key, encoded, now))
+            db.execute("INSERT INTO outbox (msg, created_at) VALUES (?, ?)", (msg, now))
+        return True
+
+    def acquire(self, name: str, ttl: float, now: float = None) -> bool:
+        """拿到（或续上）一个具名租约"""
+        now = time.time() if now is None else now
+        with self._tx() as db:
+            row = db.execute("SELECT holder, until FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != self.worker_id and row[1] > now:
+                return False
+            db.execute("INSERT OR REPLACE INTO leases (name, holder, until) VALUES (?, ?, ?)", (name, self.worker_id, now + ttl))
+        return True
+
+    def drain(self, send, now: float = None) -> int:
+        """持有 alerts 租约时把 outbox 里未发的通知交给 send（入 Discord 队列）；返回条数"""
+        if not self.acquire("alerts", SHARD_LEASE_SEC, now):
+            return 0
+        with self._tx() as db:
+            rows = db.execute("SELECT id, msg FROM outbox WHERE sent_at IS NULL ORDER BY id").fetchall()
+            for _, msg in rows:
+                send(msg)
+            if rows:
+                db.execute("UPDATE outbox SET sent_at = ? WHERE id <= ? AND sent_at IS NULL", (time.time(), rows[-1][0]))
+            db.execute("DELETE FROM outbox WHERE sent_at < ?", (time.time() - 7 * 86400,))
+        return len(rows)
+
+    def leave(self):
+        """正常退出：注销成员并释放租约，其他 worker 下次心跳就接手，不必等租约过期"""
+        self._left.set()
+        try:
+            with self._tx() as db:
+                db.execute("DELETE FROM members WHERE worker = ?", (self.worker_id,))
+                db.execute("DELETE FROM leases WHERE holder = ?", (self.worker_id,))
+        except Exception as e:
+            print(f"[shard] 注销失败: {e}", flush=True)
+
+def _use_worker_state_files(worker_id: str):
+    """
+    分片 worker 各用一份 Discord 待发队列与浏览器 Cookie 文件（文件名带 WORKER_ID）：
+    共用一份时每个 worker 启动都会把别人的待发通知再发一遍，保存时也会互相覆盖。
+    --workers 给子进程的 WORKER_ID 固定为 <host>-w<i>，重启后读回的还是自己那份。
+    """
+    tag = re.sub(r"[^\w.-]", "_", worker_id)
+    _COOKIE_STORE.path = os.path.join(STATE_DIR, f"browser_cookies.{tag}.json")
+    if _DISCORD is not None:
+        _DISCORD.spool_path = os.path.join(STATE_DIR, f"discord_spool.{tag}.json")
+
+def run_workers(count: int):
+    """python main.py --workers N：在本机起 N 个 worker 子进程（共用 STATE_DIR 与 SHARD_DB），挂了就重启"""
+    base_id = os.getenv("WORKER_ID") or socket.gethostname()
+    procs = {}
+
+    def spawn(i: int):
+        env = dict(os.environ, WORKER_ID=f"{base_id}-w{i}", SHARD_DB=SHARD_DB)
+        if METRICS_PORT:
+            env["METRICS_PORT"] = str(METRICS_PORT + i)
+        procs[i] = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker"], env=env)
+        print(f"[shard] 启动 worker {env['WORKER_ID']} (pid {procs[i].pid})", flush=True)
+
+    for i in range(count):
+        spawn(i)
+    try:
+        while True:
+            time.sleep(2)
+            for i, proc in list(procs.items()):
+                if proc.poll() is not None:
+                    print(f"[shard] worker {i} 退出（code {proc.returncode}），5s 后重启", flush=True)
+                    time.sleep(5)
+                    spawn(i)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+# ===== 主循环 =====
+def _memory_report() -> str:
+    """采样本进程与浏览器的 RSS，更新指标并返回一行摘要"""
+    rss, browser = _process_rss_mb(), _browser_rss_mb()
+    parts = []
+    if rss is not None:
+        METRICS.set("process_rss_bytes", rss * 1024 * 1024)
+        parts.append(f"RSS {rss:.0f}MB")
+    if browser:
+        METRICS.set("browser_rss_bytes", browser * 1024 * 1024)
+        parts.append(f"浏览器 {browser:.0f}MB")
+    return "，".join(parts) or "内存未知"
+
+def monitor(store: _StatusStore, coordinator: _Coordinator = None):
+    """
+    轮询主循环。coordinator 不为空时是分片 worker：只检查一致性哈希分到自己的页面，
+    通知经协调者去重后由持有 alerts 租约的 worker 统一推送。
+    """
+    print("开始监控多个商品库存状态...", flush=True)
+    if _DISCORD is not None:
+        _DISCORD.start()
+    last_status_all = store.load()
+    if last_status_all:
+        print(f"已从状态库恢复 {len(last_status_all)} 个商品的上次状态", flush=True)
+
+    watchlist = _WatchList(WATCHLIST, PRODUCTS)
+    start_metrics_server()
+    sampler = _StackSampler(PROFILE_INTERVAL_MS / 1000) if PROFILE_SLOW_CYCLE_SEC > 0 else None
+    notify, owned = None, watchlist.products
+    if coordinator is not None:
+        coordinator.start()
+        notify, owned = coordinator.publish, coordinator.owned(owned)
+        METRICS.set("shard_owned_watches", len(owned))
+        print(f"[shard] worker {coordinator.worker_id} 负责 {len(owned)}/{len(watchlist.products)} 个关注项", flush=True)
+    scheduler = _Scheduler(owned, store)
+    pool = _get_executor()
+    # 在途页面：到期就提交，不等上一批；哪个先完成就先处理、重新排期，慢站点不拖住其他站点
+    inflight = {}             # future -> ((site, url), [product, ...])
+    busy_since, busy_pages = None, 0
+    while True:
+        reshard = watchlist.poll()
+        if coordinator is not None:
+            if coordinator.changed.is_set():
+                coordinator.changed.clear()
+                reshard = True
+            coordinator.drain(send_discord_message)
+        if reshard:
+            products = watchlist.products
+            if coordinator is not None:
+                products = coordinator.owned(products)
+                # 新接手的关注项以共享状态库里的最新状态为准，不按“首次发现”重复推送
+                taken = {p["key"] for p in products} - {p["key"] for p in owned}
+                if taken:
+                    shared = store.load()
+                    last_status_all.update({k: shared[k] for k in taken if k in shared})
+                METRICS.set("shard_owned_watches", len(products))
+                print(f"[shard] 重新分片：负责 {len(products)}/{len(watchlist.products)} 个关注项（新接手 {len(taken)}）", flush=True)
+            owned = products
+            scheduler.set_products(owned)
+
+        for group in scheduler.pop_due():
+            if not inflight and busy_since is None:
+                busy_since, busy_pages = time.monotonic(), 0
+                if sampler: sampler.start()
+            products = [p for p in scheduler.products_for([group]) if p["site"] in _ADAPTERS]
+            inflight[pool.submit(_check_page_timed, *group)] = (group, products)
+
+        done = [fut for fut in inflight if fut.done()]
+        if done:
+            records, groups = [], []
+            for fut in done:
+                group, products = inflight.pop(fut)
+                group_records = apply_page_result(group, products, fut.result(), last_status_all, notify)
+                scheduler.report([group], group_records)
+                records += group_records
+                groups.append(group)
+            try:
+                store.commit(records)
             except Exception as e:
-                print(f"请求失败 {site} {name} - {color}: {e}", flush=True)
+                print(f"保存状态失败: {e}", flush=True)
+            busy_pages += len(groups)
+            print(f"完成 {len(groups)} 个页面（在途 {len(inflight)}），{_memory_report()}；{_TRANSPORT.cycle_report()}", flush=True)
+            if coordinator is not None:
+                coordinator.drain(send_discord_message)
 
-        if all_messages:
-            send_discord_message("\n\n".join(all_messages))
+        if not inflight and busy_since is not None:
+            # 一批 = 从有页面在途到全部完成的这段时间
+            elapsed = time.monotonic() - busy_since
+            busy_since = None
+            if sampler: sampler.stop()
+            METRICS.set("cycle_duration_seconds", elapsed)
+            METRICS.set("cycle_pages", busy_pages)
+            if sampler and elapsed > PROFILE_SLOW_CYCLE_SEC:
+                METRICS.inc("slow_cycles_total")
+                print(f"慢批次（>{PROFILE_SLOW_CYCLE_SEC:g}s，{busy_pages} 个页面）热点函数（占采样比例）:\n{sampler.report()}", flush=True)
 
-        time.sleep(INTERVAL_SEC)
+        nap = min(30.0, WATCHLIST_RELOAD_SEC) if WATCHLIST else 30.0   # 有配置文件时按检查间隔醒来
+        if coordinator is not None:
+            nap = min(nap, SHARD_LEASE_SEC / 3)
+        nap = min(nap, max(0.5, scheduler.next_due() - time.time()))
+        if inflight:
+            wait(list(inflight), timeout=nap, return_when=FIRST_COMPLETED)   # 有页面完成就立刻处理
+        else:
+            time.sleep(nap)
+
+def _exit_on_sigterm():
+    """
+    Railway 和 run_workers 都用 SIGTERM 停进程，Python 默认直接结束、不跑 finally 与 atexit。
+    转成 SystemExit，退出时才会注销分片成员、发完 Discord 队列、关掉浏览器与解析进程池
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+if __name__ == "__main__":
+    _exit_on_sigterm()
+    args = sys.argv[1:]
+    if "--workers" in args:
+        run_workers(int(args[args.index("--workers") + 1]))
+        sys.exit(0)
+
+    store = open_status_store()
+    if "--history" in args:
+        print_stock_history(store)
+        sys.exit(0)
+
+    coordinator = None
+    if "--worker" in args:
+        if STATUS_STORE != "sqlite":
+            print(f"WARN: 分片模式下各 worker 需要共用 sqlite 状态库（当前 STATUS_STORE={STATUS_STORE}）", flush=True)
+        coordinator = _Coordinator(SHARD_DB, WORKER_ID)
+        _use_worker_state_files(WORKER_ID)
+    try:
+        monitor(store, coordinator)
+    finally:
+        # 放在 finally 而不是 atexit：解释器退出时会先等检查线程（可能卡在慢页面上）结束，才轮到 atexit
+        if coordinator is not None:
+            coordinator.leave()
+        if _DISCORD is not None:
+            _DISCORD.flush(10)